@@ -0,0 +1,136 @@
+"""
+Shared camera capture for the live programs (image_warp, sewing_machine,
+panorama_lab).
+
+ThreadedCapture reads a cv2.VideoCapture on a background thread into a
+small ring of preallocated frames. The processing loop always gets the
+newest frame, so a slow loop drops old frames instead of letting them
+back up in the driver queue, and camera FPS no longer depends on
+processing FPS.
+"""
+
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class ThreadedCapture:
+    """cv2.VideoCapture read on a background thread, newest frame first.
+
+    Drop-in for the VideoCapture calls the programs use: isOpened(),
+    read(), set(), get() and release(). read() returns the newest captured
+    frame; frames captured since the previous read() are counted as
+    dropped. If no new frame arrives within max_wait seconds, the last one
+    is returned again and counted as a duplicate, so a stalled camera
+    doesn't freeze the window.
+    """
+
+    def __init__(self, source=0, width=None, height=None, buffer_size=2, max_wait=0.1):
+        self.cap = cv2.VideoCapture(source)
+        if width is not None:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height is not None:
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        # The writer fills one slot while the reader copies the newest, so 2 is the minimum
+        self.buffer_size = max(2, buffer_size)
+        self.max_wait = max_wait
+        self.captured = 0     # frames grabbed from the camera
+        self.delivered = 0    # distinct frames returned by read()
+        self.dropped = 0      # frames overwritten before anyone read them
+        self.duplicated = 0   # read() calls that returned the previous frame again
+        self._slots = [None] * self.buffer_size
+        self._newest = -1     # slot index of the newest frame
+        self._newest_seq = 0  # sequence number of the newest frame (1-based)
+        self._read_seq = 0    # sequence number last returned by read()
+        self._ended = False
+        self._running = False
+        self._thread = None
+        self._started_at = None
+        self._cond = threading.Condition()
+        if self.cap.isOpened():
+            self.start()
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def set(self, prop, value):
+        return self.cap.set(prop, value)
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self._thread.start()
+
+    def _capture_loop(self):
+        slot = 0
+        while self._running:
+            # Never the newest slot, which read() may be copying from
+            ret, frame = self.cap.read(self._slots[slot])
+            with self._cond:
+                if not ret:
+                    self._ended = True
+                    self._cond.notify_all()
+                    return
+                self._slots[slot] = frame
+                self._newest = slot
+                self._newest_seq += 1
+                self.captured += 1
+                self._cond.notify_all()
+            slot = (slot + 1) % self.buffer_size
+
+    def read(self, image=None):
+        """Return (ret, frame) for the newest frame, copied into image if given.
+
+        ret is False once the source has ended (or failed) and every
+        captured frame has been returned.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._newest_seq > self._read_seq or self._ended
+                                or not self._running, timeout=self.max_wait)
+            if self._newest < 0 or (self._newest_seq == self._read_seq and self._ended):
+                return False, None
+            if self._newest_seq == self._read_seq:
+                self.duplicated += 1
+            else:
+                self.dropped += self._newest_seq - self._read_seq - 1
+                self.delivered += 1
+                self._read_seq = self._newest_seq
+            newest = self._slots[self._newest]
+            if image is not None and image.shape == newest.shape:
+                np.copyto(image, newest)
+                return True, image
+            return True, newest.copy()
+
+    def stats(self):
+        """Counters plus the camera's measured frame rate."""
+        elapsed = time.perf_counter() - self._started_at if self._started_at else 0.0
+        return {
+            "captured": self.captured,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "duplicated": self.duplicated,
+            "capture_fps": self.captured / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def stats_text(self):
+        """One-line summary for a HUD."""
+        stats = self.stats()
+        return (f"Cam: {stats['capture_fps']:.1f} FPS | "
+                f"dropped {stats['dropped']} | dup {stats['duplicated']}")
+
+    def release(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        self.cap.release()
@@ -0,0 +1,114 @@
+"""
+Cached keypoints and descriptors for images that don't change.
+
+A static reference (sewing_machine's self.jpg) gives the same SIFT
+features every frame, so they are computed once per image and size.
+The results are kept in memory and saved as an .npz next to the image:
+
+    self.jpg  ->  self.640x480.sift.npz
+
+Each cache file stores a key made from the image's SHA-256, the size it
+was resized to, the detector name and the OpenCV version. If any of
+those differ (the image was replaced, a different window size, a newer
+OpenCV), the file is ignored and rewritten.
+"""
+
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+# (path, size, detector) -> (keypoints, descriptors)
+_memory = {}
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_path(image_path, size, detector="sift"):
+    """Where the features of image_path resized to size=(w, h) are saved."""
+    stem = os.path.splitext(image_path)[0]
+    return f"{stem}.{size[0]}x{size[1]}.{detector}.npz"
+
+
+def keypoints_to_array(keypoints):
+    """KeyPoints as an (N, 7) array: x, y, size, angle, response, octave, class_id.
+
+    float64, since SIFT packs octave, layer and scale into octave and
+    float32 would round it.
+    """
+    return np.float64([(kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response, kp.octave,
+                        kp.class_id) for kp in keypoints]).reshape(-1, 7)
+
+
+def array_to_keypoints(rows):
+    return [cv2.KeyPoint(float(x), float(y), float(size), float(angle), float(response),
+                         int(octave), int(class_id))
+            for x, y, size, angle, response, octave, class_id in rows]
+
+
+def _cache_key(image_path, size, detector):
+    return f"{file_sha256(image_path)}:{size[0]}x{size[1]}:{detector}:{cv2.__version__}"
+
+
+def _load(path, key):
+    try:
+        with np.load(path) as data:
+            if str(data["key"]) != key:
+                return None
+            descriptors = data["descriptors"]
+            return (array_to_keypoints(data["keypoints"]),
+                    descriptors if len(descriptors) else None)
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _save(path, key, keypoints, descriptors):
+    if descriptors is None:
+        descriptors = np.zeros((0, 128), np.float32)
+    # Write then rename, so a reader (or another worker process) never sees half a file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            np.savez(f, key=key, keypoints=keypoints_to_array(keypoints),
+                     descriptors=descriptors)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Could not save feature cache {path}: {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def cached_features(image_path, size, detector, image=None, name="sift"):
+    """(keypoints, descriptors) for image_path resized to size=(w, h).
+
+    Computed with detector.detectAndCompute on the grayscale image the
+    first time, then served from memory, or from the .npz cache on later
+    runs. image is the already-loaded BGR image, if the caller has it.
+    Returns (features, source) where source is "memory", "disk" or
+    "computed".
+    """
+    memory_key = (os.path.abspath(image_path), tuple(size), name)
+    if memory_key in _memory:
+        return _memory[memory_key], "memory"
+    key = _cache_key(image_path, size, name)
+    path = cache_path(image_path, size, name)
+    features = _load(path, key) if os.path.exists(path) else None
+    source = "disk"
+    if features is None:
+        if image is None:
+            image = cv2.imread(image_path)
+            if image is None:
+                raise IOError(f"Could not read image {image_path}")
+        gray = cv2.cvtColor(cv2.resize(image, tuple(size)), cv2.COLOR_BGR2GRAY)
+        features = detector.detectAndCompute(gray, None)
+        _save(path, key, *features)
+        source = "computed"
+    _memory[memory_key] = features
+    return features, source
@@ -0,0 +1,293 @@
+"""
+Where the live programs get their frames from.
+
+open_source() turns a --source string into something with the
+cv2.VideoCapture calls the main loops use (isOpened, read, release),
+plus stats_text() for the HUD:
+
+    0, 1, ...                   webcam index (read by a ThreadedCapture)
+    clip.mp4                    video file, every frame in order
+    frames/ or "frames/*.png"   image sequence in filename order, or a
+                                recorded session (directory with manifest.json)
+    synthetic[:WxH[:N]]         generated moving texture, N frames (default 300)
+
+Everything except a webcam is deterministic, so the same --source gives
+the same frames on every run, with no camera or display needed.
+FrameRecorder (or open_source(..., record=dir)) saves a live session as
+PNGs plus a manifest, which can be passed back as --source to replay it.
+"""
+
+import glob
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from common.capture import ThreadedCapture
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+MANIFEST_NAME = "manifest.json"
+
+
+class FrameSource:
+    """Base for the non-camera sources: frames are read in order, none dropped."""
+
+    description = "source"
+
+    def __init__(self):
+        self.frame_index = 0  # frames returned so far
+        self.frame_count = None  # total, when known
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        return False
+
+    def get(self, prop):
+        return 0
+
+    def _next_frame(self, image):
+        """Return the next frame (written into image when possible), or None at the end."""
+        raise NotImplementedError
+
+    def read(self, image=None):
+        frame = self._next_frame(image)
+        if frame is None:
+            return False, None
+        self.frame_index += 1
+        if image is not None and frame is not image and image.shape == frame.shape:
+            np.copyto(image, frame)
+            frame = image
+        return True, frame
+
+    def stats_text(self):
+        total = f"/{self.frame_count}" if self.frame_count else ""
+        return f"{self.description}: frame {self.frame_index}{total}"
+
+    def release(self):
+        pass
+
+
+class VideoFileSource(FrameSource):
+    """Every frame of a video file, in order."""
+
+    def __init__(self, path):
+        super().__init__()
+        self.description = os.path.basename(path)
+        self.cap = cv2.VideoCapture(path)
+        count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frame_count = count if count > 0 else None
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def _next_frame(self, image):
+        ret, frame = self.cap.read(image)
+        return frame if ret else None
+
+    def release(self):
+        self.cap.release()
+
+
+class ImageSequenceSource(FrameSource):
+    """Images from a directory (sorted by name, or in manifest order) or a glob.
+
+    With realtime=True and a recorded manifest, frames are paced at the
+    recorded timestamps instead of being returned as fast as possible.
+    """
+
+    def __init__(self, path, realtime=False):
+        super().__init__()
+        self.description = os.path.basename(os.path.normpath(path)) or path
+        self.timestamps = None
+        manifest_path = os.path.join(path, MANIFEST_NAME) if os.path.isdir(path) else None
+        if manifest_path and os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            self.files = [os.path.join(path, entry["file"]) for entry in manifest["frames"]]
+            self.timestamps = [entry["t"] for entry in manifest["frames"]]
+            self.description = f"replay {self.description}"
+        else:
+            names = (glob.glob(path) if not os.path.isdir(path)
+                     else [os.path.join(path, name) for name in os.listdir(path)])
+            self.files = sorted(n for n in names if n.lower().endswith(IMAGE_EXTENSIONS))
+        self.frame_count = len(self.files)
+        self.realtime = realtime and self.timestamps is not None
+        self._started_at = None
+
+    def isOpened(self):
+        return bool(self.files)
+
+    def _next_frame(self, image):
+        if self.frame_index >= len(self.files):
+            return None
+        if self.realtime:
+            if self._started_at is None:
+                self._started_at = time.perf_counter() - self.timestamps[0]
+            delay = self._started_at + self.timestamps[self.frame_index] - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        path = self.files[self.frame_index]
+        frame = cv2.imread(path)
+        if frame is None:
+            raise IOError(f"Could not read image {path}")
+        return frame
+
+
+class SyntheticSource(FrameSource):
+    """A textured scene panning sideways, generated from a fixed seed.
+
+    Frames are windows onto one wide random texture (blurred noise with
+    shapes), shifted step pixels per frame, so feature detectors and
+    trackers have something to find and consecutive frames overlap.
+    Past the end of the texture the pan starts over.
+    """
+
+    def __init__(self, width=640, height=480, frames=300, step=4, seed=0):
+        super().__init__()
+        self.description = f"synthetic {width}x{height}"
+        self.frame_count = frames
+        self.width = width
+        self.step = step
+        rng = np.random.default_rng(seed)
+        scene_width = width + min(frames * step, 3 * width)
+        noise = rng.integers(0, 256, (height // 8 + 1, scene_width // 8 + 1, 3), dtype=np.uint8)
+        scene = cv2.resize(noise, (scene_width, height), interpolation=cv2.INTER_CUBIC)
+        for _ in range(scene_width // 20):
+            color = tuple(int(c) for c in rng.integers(0, 256, 3))
+            x, y = int(rng.integers(0, scene_width)), int(rng.integers(0, height))
+            size = int(rng.integers(8, 40))
+            if rng.random() < 0.5:
+                cv2.rectangle(scene, (x, y), (x + size, y + size), color, -1)
+            else:
+                cv2.circle(scene, (x, y), size // 2, color, -1)
+        self.scene = scene
+
+    def _next_frame(self, image):
+        if self.frame_index >= self.frame_count:
+            return None
+        x = self.frame_index * self.step % (self.scene.shape[1] - self.width + 1)
+        window = self.scene[:, x:x + self.width]
+        if image is not None and image.shape == window.shape:
+            np.copyto(image, window)
+            return image
+        return window.copy()
+
+
+def parse_synthetic(spec):
+    """Keyword arguments for SyntheticSource from "synthetic[:WxH[:N]]"."""
+    parts = spec.split(":")[1:]
+    kwargs = {}
+    if parts and parts[0]:
+        width, height = parts[0].lower().split("x")
+        kwargs["width"], kwargs["height"] = int(width), int(height)
+    if len(parts) > 1 and parts[1]:
+        kwargs["frames"] = int(parts[1])
+    return kwargs
+
+
+def open_source(spec, width=640, height=480, realtime=False, record=None):
+    """Open a frame source from a --source string (see the module docstring).
+
+    width/height are requested from webcams. record, a directory, saves
+    every frame read to it for later replay.
+    """
+    spec = str(spec)
+    if spec.isdigit():
+        source = ThreadedCapture(int(spec), width=width, height=height)
+    elif spec.startswith("synthetic"):
+        source = SyntheticSource(**parse_synthetic(spec))
+    elif os.path.isdir(spec) or glob.has_magic(spec):
+        source = ImageSequenceSource(spec, realtime=realtime)
+    else:
+        source = VideoFileSource(spec)
+    if record:
+        source = RecordingSource(source, FrameRecorder(record, spec))
+    return source
+
+
+def iter_frames(spec, count=None):
+    """Yield frames from a source until it ends (or after count frames)."""
+    source = open_source(spec)
+    if not source.isOpened():
+        source.release()
+        raise IOError(f"Could not open source {spec}")
+    try:
+        index = 0
+        while count is None or index < count:
+            ret, frame = source.read()
+            if not ret:
+                break
+            yield frame
+            index += 1
+    finally:
+        source.release()
+
+
+class FrameRecorder:
+    """Saves frames as numbered PNGs plus a manifest.json with their timestamps.
+
+    The directory can be given back to open_source() to replay the session.
+    """
+
+    def __init__(self, directory, source_spec=""):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.source_spec = source_spec
+        self.frames = []
+        self._started_at = None
+
+    def write(self, frame):
+        now = time.perf_counter()
+        if self._started_at is None:
+            self._started_at = now
+        name = f"frame_{len(self.frames):06d}.png"
+        # Low compression: lossless either way, and much faster to write live
+        cv2.imwrite(os.path.join(self.directory, name), frame, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+        self.frames.append({"file": name, "t": round(now - self._started_at, 6)})
+
+    def close(self):
+        manifest = {
+            "source": self.source_spec,
+            "recorded": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "frames": self.frames,
+        }
+        with open(os.path.join(self.directory, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f, indent=1)
+        print(f"Recorded {len(self.frames)} frames to {self.directory}")
+
+
+class RecordingSource:
+    """Wraps a source and records every frame read from it."""
+
+    def __init__(self, source, recorder):
+        self.source = source
+        self.recorder = recorder
+
+    def isOpened(self):
+        return self.source.isOpened()
+
+    def set(self, prop, value):
+        return self.source.set(prop, value)
+
+    def get(self, prop):
+        return self.source.get(prop)
+
+    def read(self, image=None):
+        ret, frame = self.source.read(image)
+        if ret:
+            self.recorder.write(frame)
+        return ret, frame
+
+    def stats_text(self):
+        return f"REC {len(self.recorder.frames)} | {self.source.stats_text()}"
+
+    def release(self):
+        self.source.release()
+        self.recorder.close()
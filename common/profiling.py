@@ -0,0 +1,245 @@
+"""
+Opt-in profiling for every entry point in the repository.
+
+Set CV_PROFILE (or pass --profile to programs that take arguments) to
+profile a run without wrapping the script by hand:
+
+    CV_PROFILE=cpu,mem python mini-project2/image_warp.py
+    python mini-project3/sewing_machine.py --profile cpu --profile-frames 50:250
+
+Modes:
+    cpu   a sampling profiler: a background thread records every other
+          thread's Python stack each CV_PROFILE_INTERVAL seconds (default
+          0.005) and writes collapsed stacks ("a;b;c count" lines), which
+          flamegraph.pl, speedscope and inferno read directly
+    mem   tracemalloc snapshots at the start and end of the window, with
+          the top CV_PROFILE_TOP (default 25) allocating lines written out
+
+Programs with a frame loop call profiler.frame() once per frame, and
+CV_PROFILE_FRAMES=START:STOP (or --profile-frames) limits profiling to
+that window, e.g. 100:400 to skip start-up. Without a window, or in
+scripts with no frame loop, the whole run is profiled. Results go to
+CV_PROFILE_DIR (default ./profiles) when the window ends or at exit.
+Worker processes (pipeline and parallel render modes) are not profiled.
+
+When profiling is off the programs get NULL_PROFILER, whose methods do
+nothing.
+"""
+
+import atexit
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+MODES = ("cpu", "mem")
+
+
+def parse_window(spec):
+    """(start, stop) frame numbers from "START:STOP", "START:" or ":STOP"."""
+    if not spec:
+        return 0, None
+    start, _, stop = spec.partition(":")
+    return int(start or 0), int(stop) if stop else None
+
+
+class StackSampler:
+    """Samples the Python stacks of all other threads on a timer."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    # Current line, as py-spy does, so hot calls inside one function separate
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                                 f":{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write_collapsed(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """CPU sampling and/or tracemalloc over a frame window."""
+
+    enabled = True
+
+    def __init__(self, name, modes=MODES, window=(0, None), out_dir="profiles",
+                 interval=0.005, top=25):
+        self.name = name
+        self.modes = set(modes)
+        self.start_frame, self.stop_frame = window
+        self.out_dir = out_dir
+        self.interval = interval
+        self.top = top
+        self.frames = 0
+        self.running = False
+        self.done = False
+        self._sampler = None
+        self._snapshot = None
+        self._stop_tracing = False
+        self._started_at = None
+        atexit.register(self.close)
+        if self.start_frame == 0:
+            self.start()
+
+    def frame(self):
+        """Call once per frame; starts and stops profiling at the window edges."""
+        self.frames += 1
+        if self.frames == self.start_frame and not self.running and not self.done:
+            self.start()
+        elif self.stop_frame is not None and self.frames == self.stop_frame:
+            self.close()
+
+    def start(self):
+        self.running = True
+        self._started_at = time.perf_counter()
+        if "mem" in self.modes:
+            # Leave tracing on at the end if someone else (e.g. --alloc) started it
+            self._stop_tracing = not tracemalloc.is_tracing()
+            if self._stop_tracing:
+                tracemalloc.start()
+            self._snapshot = tracemalloc.take_snapshot()
+        if "cpu" in self.modes:
+            self._sampler = StackSampler(self.interval)
+            self._sampler.start()
+
+    def close(self):
+        """Stop profiling (if running) and write the results."""
+        if not self.running or self.done:
+            return
+        self.running = False
+        self.done = True
+        elapsed = time.perf_counter() - self._started_at
+        os.makedirs(self.out_dir, exist_ok=True)
+        base = os.path.join(self.out_dir, f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}")
+        window = f"frames {self.start_frame}-{self.frames}" if self.frames else "whole run"
+        print(f"\nProfile of {self.name} ({window}, {elapsed:.1f}s):")
+        if self._sampler is not None:
+            self._sampler.stop()
+            path = base + ".collapsed"
+            self._sampler.write_collapsed(path)
+            print(f"  CPU: {self._sampler.samples} samples -> {path}")
+        if self._snapshot is not None:
+            path = base + ".alloc.txt"
+            self._write_alloc_report(path)
+            print(f"  Memory: top {self.top} allocating lines -> {path}")
+
+    def _write_alloc_report(self, path):
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stop_tracing:
+            tracemalloc.stop()
+        # Leave out the profiler's own allocations: tracemalloc, this module, and the
+        # threading machinery the sampler thread runs on
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+                   tracemalloc.Filter(False, __file__),
+                   tracemalloc.Filter(False, threading.__file__)]
+        growth = snapshot.filter_traces(filters).compare_to(
+            self._snapshot.filter_traces(filters), "lineno")
+        live = snapshot.filter_traces(filters).statistics("lineno")
+        with open(path, "w") as f:
+            f.write(f"{self.name}: traced memory {current / 1e6:.1f} MB now, "
+                    f"{peak / 1e6:.1f} MB peak\n\n")
+            f.write(f"Top {self.top} lines by growth over the window:\n")
+            for stat in growth[:self.top]:
+                f.write(f"  {stat}\n")
+            f.write(f"\nTop {self.top} lines by memory held at the end:\n")
+            for stat in live[:self.top]:
+                f.write(f"  {stat}\n")
+
+
+class NullProfiler:
+    """Stands in for Profiler when profiling is off; every call is a no-op."""
+
+    enabled = False
+
+    def frame(self):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def make_profiler(name, modes=None, frames=None):
+    """A Profiler if modes (or CV_PROFILE) asks for one, otherwise NULL_PROFILER.
+
+    modes is a string like "cpu,mem" ("1" or "all" mean both); frames is
+    a "START:STOP" window. Both default to the environment variables.
+    """
+    modes = modes or os.environ.get("CV_PROFILE", "")
+    if not modes or modes.lower() in ("0", "off", "false"):
+        return NULL_PROFILER
+    if modes.lower() in ("1", "all", "on", "true"):
+        selected = MODES
+    else:
+        selected = [m.strip() for m in modes.lower().split(",") if m.strip()]
+        unknown = set(selected) - set(MODES)
+        if unknown:
+            raise ValueError(f"Unknown profile mode(s) {', '.join(sorted(unknown))}; "
+                             f"use {', '.join(MODES)}")
+    return Profiler(
+        name, selected,
+        window=parse_window(frames or os.environ.get("CV_PROFILE_FRAMES")),
+        out_dir=os.environ.get("CV_PROFILE_DIR", "profiles"),
+        interval=float(os.environ.get("CV_PROFILE_INTERVAL", 0.005)),
+        top=int(os.environ.get("CV_PROFILE_TOP", 25)),
+    )
+
+
+def add_profile_args(parser):
+    """Add --profile and --profile-frames to an argparse parser."""
+    parser.add_argument("--profile", nargs="?", const="cpu,mem", metavar="MODES",
+                        help="profile this run: cpu, mem or cpu,mem (default both); "
+                             "also set by CV_PROFILE")
+    parser.add_argument("--profile-frames", metavar="START:STOP",
+                        help="only profile this frame window (also CV_PROFILE_FRAMES)")
+
+
+def profiler_from_args(name, args):
+    return make_profiler(name, args.profile, args.profile_frames)
+
+
+def profile_script(name):
+    """Profile a whole script run if CV_PROFILE is set; results are written at exit.
+
+    Without CV_PROFILE this returns NULL_PROFILER and does nothing, so
+    scripts can call it unconditionally.
+    """
+    return make_profiler(name)
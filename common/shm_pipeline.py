@@ -0,0 +1,313 @@
+"""
+Multi-process frame pipeline over shared memory.
+
+    capture process  ->  worker processes  ->  main process (render)
+
+The capture process reads one or more frame sources (see frame_source.py)
+straight into slots of a multiprocessing.shared_memory ring, and queues
+only (sequence number, slot index). Workers run process(state, frames,
+context) on the slot in place and send back small results; frames are
+never pickled. The main process gets (seq, frames, result) in capture
+order, draws and displays, and the slot goes back to the free list when
+it asks for the next frame.
+
+A webcam is read by a ThreadedCapture inside the capture process, so
+when every slot is busy the camera keeps only its newest frame; files
+and synthetic sources wait for a free slot, so no frame is skipped.
+
+context is optional data the main process can change while running
+(e.g. descriptors of a reference frame): a 2-D uint8 array written to a
+second shared-memory block with set_context(), which workers pick up
+before their next frame.
+"""
+
+import multiprocessing as mp
+import queue
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from common.frame_source import open_source
+
+# How often blocked processes wake up to check for shutdown, in seconds
+POLL_SECONDS = 0.1
+CONTEXT_HEADER = 3  # int64 version, rows, cols
+
+
+def _attach(name, shape):
+    """Attach to a shared-memory block and view it as a uint8 array."""
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+
+
+def _capture_main(specs, width, height, realtime, record, shape_q, setup_q,
+                  free_q, task_q, result_q, stop, dropped, num_workers):
+    sources = [open_source(spec, width=width, height=height, realtime=realtime,
+                           record=record if i == 0 else None)
+               for i, spec in enumerate(specs)]
+    first = []
+    for source in sources:
+        ret, frame = source.read() if source.isOpened() else (False, None)
+        first.append(frame if ret else None)
+    if any(frame is None for frame in first):
+        shape_q.put(None)
+        for source in sources:
+            source.release()
+        return
+    h, w = first[0].shape[:2]
+    shape_q.put((len(sources), h, w, 3))
+    name, num_slots = setup_q.get()
+    shm, slots = _attach(name, (num_slots, len(sources), h, w, 3))
+
+    seq = 0
+    pending = first
+    try:
+        while not stop.is_set():
+            try:
+                slot = free_q.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+            ok = True
+            for i, source in enumerate(sources):
+                view = slots[slot, i]
+                if pending is not None:
+                    frame = pending[i]
+                else:
+                    ret, frame = source.read(view)
+                    if not ret:
+                        ok = False
+                        break
+                if frame is not view:
+                    if frame.shape[:2] != (h, w):
+                        cv2.resize(frame, (w, h), dst=view)
+                    else:
+                        np.copyto(view, frame)
+            pending = None
+            if not ok:
+                break
+            dropped.value = getattr(sources[0], "dropped", 0)
+            task_q.put((seq, slot))
+            seq += 1
+    finally:
+        for _ in range(num_workers):
+            task_q.put(None)
+        result_q.put(("end", seq, None, None))
+        for source in sources:
+            source.release()
+        del slots
+        shm.close()
+
+
+def _worker_main(process, setup, setup_args, name, shape, context_name, context_bytes,
+                 context_lock, task_q, result_q):
+    try:
+        state = setup(*setup_args) if setup is not None else None
+    except Exception:
+        result_q.put(("error", -1, None, traceback.format_exc()))
+        return
+    shm, slots = _attach(name, shape)
+    context_shm = context_header = None
+    if context_name:
+        context_shm = shared_memory.SharedMemory(name=context_name)
+        context_header = np.ndarray(CONTEXT_HEADER, dtype=np.int64, buffer=context_shm.buf)
+    context, context_version = None, 0
+    try:
+        while True:
+            item = task_q.get()
+            if item is None:
+                break
+            seq, slot = item
+            if context_header is not None and context_header[0] != context_version:
+                with context_lock:
+                    context_version, rows, cols = (int(v) for v in context_header)
+                    data = np.ndarray(context_bytes, dtype=np.uint8, buffer=context_shm.buf,
+                                      offset=CONTEXT_HEADER * 8)
+                    context = data[:rows * cols].reshape(rows, cols).copy() if rows else None
+                    del data
+            try:
+                result = process(state, slots[slot], context)
+            except Exception:
+                result_q.put(("error", seq, slot, traceback.format_exc()))
+                continue
+            result_q.put(("result", seq, slot, result))
+    finally:
+        del slots
+        shm.close()
+        if context_shm is not None:
+            del context_header
+            context_shm.close()
+
+
+class SharedFramePipeline:
+    """Run process(state, frames, context) on every frame across worker processes.
+
+    sources are frame-source specs read together (e.g. left and right
+    cameras); frames is a (len(sources), h, w, 3) view of one slot, later
+    sources resized to the first one's size. setup(*setup_args) runs
+    once per worker to build state (detectors, matchers, references).
+    process, setup and results must be picklable (module-level functions,
+    arrays and plain values).
+
+    Iterating yields (seq, frames, result) in capture order. frames is
+    only valid until the next iteration; copy anything kept longer.
+    """
+
+    def __init__(self, sources, process, setup=None, setup_args=(), workers=2,
+                 slots=None, width=640, height=480, realtime=False, record=None,
+                 context_bytes=0):
+        self.sources = [str(spec) for spec in sources]
+        self.process = process
+        self.setup = setup
+        self.setup_args = setup_args
+        self.workers = max(1, workers)
+        # A frame being captured, one per worker, one being rendered, and one spare
+        self.num_slots = slots or self.workers + 3
+        self.width, self.height = width, height
+        self.realtime = realtime
+        self.record = record
+        self.context_bytes = context_bytes
+        self.frames = 0
+        self.shape = None
+        self._ctx = mp.get_context("spawn")
+        self._processes = []
+        self._shm = self._slots = None
+        self._context_shm = self._context_header = None
+        self._context_version = 0
+        self._stop = self._ctx.Event()
+        self._dropped = self._ctx.Value("q", 0, lock=False)
+        self._context_lock = self._ctx.Lock()
+
+    @property
+    def dropped(self):
+        """Camera frames replaced by newer ones while every slot was busy."""
+        return self._dropped.value
+
+    def start(self):
+        """Start all processes. Raises IOError if a source can't be opened."""
+        ctx = self._ctx
+        shape_q, setup_q = ctx.Queue(), ctx.Queue()
+        self._free_q, self._task_q, self._result_q = ctx.Queue(), ctx.Queue(), ctx.Queue()
+        capture = ctx.Process(target=_capture_main, name="capture", daemon=True, args=(
+            self.sources, self.width, self.height, self.realtime, self.record, shape_q,
+            setup_q, self._free_q, self._task_q, self._result_q, self._stop,
+            self._dropped, self.workers))
+        capture.start()
+        self._processes.append(capture)
+        shape = shape_q.get()
+        if shape is None:
+            self.stop()
+            raise IOError(f"Could not open source(s) {', '.join(self.sources)}")
+        self.shape = shape
+
+        slot_shape = (self.num_slots,) + shape
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(slot_shape)))
+        self._slots = np.ndarray(slot_shape, dtype=np.uint8, buffer=self._shm.buf)
+        context_name = None
+        if self.context_bytes:
+            self._context_shm = shared_memory.SharedMemory(
+                create=True, size=CONTEXT_HEADER * 8 + self.context_bytes)
+            self._context_header = np.ndarray(CONTEXT_HEADER, dtype=np.int64,
+                                              buffer=self._context_shm.buf)
+            self._context_header[:] = 0
+            context_name = self._context_shm.name
+        for i in range(self.workers):
+            worker = ctx.Process(target=_worker_main, name=f"worker-{i}", daemon=True, args=(
+                self.process, self.setup, self.setup_args, self._shm.name, slot_shape,
+                context_name, self.context_bytes, self._context_lock, self._task_q,
+                self._result_q))
+            worker.start()
+            self._processes.append(worker)
+        for slot in range(self.num_slots):
+            self._free_q.put(slot)
+        setup_q.put((self._shm.name, self.num_slots))
+        return self
+
+    def set_context(self, array):
+        """Give workers a new 2-D uint8 context array (None clears it)."""
+        if self._context_header is None:
+            raise ValueError("Pipeline was created without context_bytes")
+        rows, cols = (0, 0) if array is None else array.shape
+        if rows * cols > self.context_bytes:
+            raise ValueError(f"Context of {rows * cols} bytes exceeds {self.context_bytes}")
+        with self._context_lock:
+            if rows:
+                data = np.ndarray(rows * cols, dtype=np.uint8, buffer=self._context_shm.buf,
+                                  offset=CONTEXT_HEADER * 8)
+                data[:] = np.ascontiguousarray(array, dtype=np.uint8).ravel()
+                del data
+            self._context_version += 1
+            self._context_header[:] = (self._context_version, rows, cols)
+
+    def __iter__(self):
+        if self._shm is None:
+            self.start()
+        done = {}  # seq -> (slot, result), results that arrived early
+        next_seq = 0
+        end = None
+        slot = None
+        try:
+            while end is None or next_seq < end:
+                if next_seq in done:
+                    slot, result = done.pop(next_seq)
+                    yield next_seq, self._slots[slot], result
+                    self._free_q.put(slot)
+                    slot = None
+                    next_seq += 1
+                    self.frames += 1
+                    continue
+                try:
+                    kind, seq, result_slot, result = self._result_q.get(timeout=POLL_SECONDS)
+                except queue.Empty:
+                    self._check_processes(end)
+                    continue
+                if kind == "end":
+                    end = seq
+                elif kind == "error":
+                    raise RuntimeError(f"Pipeline worker failed:\n{result}")
+                else:
+                    done[seq] = (result_slot, result)
+        finally:
+            self.stop()
+
+    def _check_processes(self, end):
+        """Raise if a process died, since the frames it held would never arrive."""
+        for process in self._processes:
+            if process.is_alive():
+                continue
+            # Workers exit cleanly only once capture has ended; capture only after "end"
+            if process.exitcode != 0 or end is None:
+                raise RuntimeError(f"Pipeline {process.name} process exited unexpectedly "
+                                   f"(exit code {process.exitcode})")
+
+    def stop(self):
+        """Stop every process and free the shared memory."""
+        self._stop.set()
+        deadline = time.perf_counter() + 2.0
+        while any(p.is_alive() for p in self._processes) and time.perf_counter() < deadline:
+            # A process can't exit until what it queued is read, so keep draining
+            for q in (self._result_q, self._task_q):
+                try:
+                    while True:
+                        q.get_nowait()
+                except (queue.Empty, AttributeError):
+                    pass
+            for process in self._processes:
+                process.join(timeout=POLL_SECONDS / 4)
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        for name in ("_slots", "_context_header"):
+            setattr(self, name, None)
+        for shm in (self._shm, self._context_shm):
+            if shm is None:
+                continue
+            try:
+                shm.close()
+            except BufferError:
+                pass  # a caller still holds a frame view; the mapping goes at exit
+            shm.unlink()
+        self._shm = self._context_shm = None
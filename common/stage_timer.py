@@ -0,0 +1,150 @@
+"""
+Per-stage latency measurement for the live loops.
+
+A loop calls start_frame(), then mark(stage) after each stage of work
+(capture, convert, detect, match, warp, draw, display ...), then
+end_frame(). Each mark records the time since the previous one, so
+stages need no nesting or with-blocks. StageTimer keeps the last
+`window` frames of every stage for rolling p50/p95/p99, can draw them
+as a HUD, and can write one row per frame to a CSV or JSON trace.
+
+When timing is off the loops use NULL_TIMER, whose methods do nothing,
+so the instrumentation costs no more than an empty method call.
+"""
+
+import csv
+import json
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+
+class StageTimer:
+    """Rolling per-stage latency statistics, in milliseconds."""
+
+    enabled = True
+
+    def __init__(self, window=120, trace_path=None, refresh_every=15):
+        self.window = window
+        self.stages = []  # in first-seen order
+        self.samples = {"frame": deque(maxlen=window)}
+        self.frames = 0
+        self.refresh_every = refresh_every
+        self._current = {}
+        self._frame_start = None
+        self._last = None
+        self._start_time = time.perf_counter()
+        self._hud_lines = []
+        self._trace_path = trace_path
+        self._trace_rows = []  # written at close(), once every stage is known
+
+    def start_frame(self):
+        self._frame_start = self._last = time.perf_counter()
+        self._current = {}
+
+    def mark(self, stage):
+        """Charge the time since the last mark (or start_frame) to stage."""
+        now = time.perf_counter()
+        self._current[stage] = self._current.get(stage, 0.0) + (now - self._last) * 1000
+        self._last = now
+
+    def end_frame(self):
+        now = time.perf_counter()
+        total = (now - self._frame_start) * 1000
+        for stage, ms in self._current.items():
+            if stage not in self.samples:
+                self.stages.append(stage)
+                self.samples[stage] = deque(maxlen=self.window)
+            self.samples[stage].append(ms)
+        self.samples["frame"].append(total)
+        if self._trace_path:
+            self._write_trace(now, total)
+        self.frames += 1
+        if self.frames % self.refresh_every == 1:
+            self._hud_lines = self._format_lines()
+
+    def percentiles(self, stage):
+        """(p50, p95, p99) of stage over the window, in ms."""
+        values = self.samples.get(stage)
+        if not values:
+            return 0.0, 0.0, 0.0
+        return tuple(np.percentile(values, (50, 95, 99)))
+
+    def summary(self):
+        """{stage: (p50, p95, p99)} for every stage plus the whole frame."""
+        return {stage: self.percentiles(stage) for stage in self.stages + ["frame"]}
+
+    def _format_lines(self):
+        lines = ["stage      p50   p95   p99 ms"]
+        for stage, (p50, p95, p99) in self.summary().items():
+            lines.append(f"{stage:<8}{p50:6.1f}{p95:6.1f}{p99:6.1f}")
+        return lines
+
+    def draw(self, img, x, y):
+        """Draw the breakdown on img, top-left at (x, y); refreshed every few frames."""
+        for i, line in enumerate(self._hud_lines):
+            cv2.putText(img, line, (x, y + 18 * i), cv2.FONT_HERSHEY_PLAIN, 1.0,
+                        (0, 255, 255), 1)
+
+    def _write_trace(self, now, total):
+        row = {"frame": self.frames, "t": round(now - self._start_time, 6)}
+        row.update({stage: round(ms, 4) for stage, ms in self._current.items()})
+        row["total"] = round(total, 4)
+        self._trace_rows.append(row)
+
+    def report(self):
+        """Print the percentile table."""
+        print(f"\nStage latency over the last {min(self.frames, self.window)} frames (ms):")
+        print(f"  {'stage':<10}{'p50':>8}{'p95':>8}{'p99':>8}")
+        for stage, (p50, p95, p99) in self.summary().items():
+            print(f"  {stage:<10}{p50:8.2f}{p95:8.2f}{p99:8.2f}")
+
+    def close(self):
+        """Print the report and finish the trace file."""
+        if self.frames:
+            self.report()
+        if not self._trace_path:
+            return
+        if self._trace_path.endswith(".json"):
+            with open(self._trace_path, "w") as f:
+                json.dump({"stages": self.stages, "frames": self._trace_rows}, f, indent=1)
+        else:
+            # Stages that didn't run in a frame (e.g. stitching) are left blank
+            with open(self._trace_path, "w", newline="") as f:
+                writer = csv.DictWriter(f, ["frame", "t"] + self.stages + ["total"], restval="")
+                writer.writeheader()
+                writer.writerows(self._trace_rows)
+        print(f"Trace saved: {self._trace_path}")
+
+
+class NullStageTimer:
+    """Stands in for StageTimer when timing is off; every call is a no-op."""
+
+    enabled = False
+
+    def start_frame(self):
+        pass
+
+    def mark(self, stage):
+        pass
+
+    def end_frame(self):
+        pass
+
+    def draw(self, img, x, y):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_TIMER = NullStageTimer()
+
+
+def make_timer(enabled, trace_path=None):
+    """A StageTimer if timing or a trace was asked for, otherwise NULL_TIMER."""
+    if enabled or trace_path:
+        return StageTimer(trace_path=trace_path)
+    return NULL_TIMER
@@ -0,0 +1,310 @@
+"""
+File: benchmark.py
+------------------
+Times the image operations in imageexample.py and bluescreen.py on
+synthetic images of several sizes, in each way SimpleImage can run them:
+
+  pixel       the original for-pixel-in-image loops
+  vectorized  whole-channel array operations
+  lut         256-entry lookup tables (apply_lut)
+  fused       a lazy ops() chain run as one pass
+  parallel    the per-pixel function spread over processes with map_rows
+
+Reports megapixels/second and peak traced memory, can write the results
+as JSON, and can compare them against a saved baseline, exiting with
+status 1 if anything got slower than the allowed tolerance:
+
+  python benchmark.py --sizes 0.1 1 4 --output outputs/bench.json
+  python benchmark.py --save-baseline outputs/bench_baseline.json
+  python benchmark.py --baseline outputs/bench_baseline.json --tolerance 0.25
+
+Pixel-loop modes take minutes per megapixel, so by default they only
+run up to --pixel-max-mp. Timings include one in-memory copy of the
+input image per run (in place of decoding a file). Peak memory is
+measured in a separate run with tracemalloc, and does not see memory
+used inside worker processes.
+"""
+
+import argparse
+import contextlib
+import functools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import bluescreen
+import imageexample
+from simpleimage import SimpleImage
+
+DEFAULT_SIZES = [0.1, 1, 4, 12, 24]
+
+
+def synthetic_image(megapixels, seed=0):
+    """
+    A 4:3 RGB test image of about megapixels, random noise with a
+    strongly blue block on the left third so bluescreen has work to do.
+    """
+    height = max(1, int(round((megapixels * 1e6 * 3 / 4) ** 0.5)))
+    width = max(1, int(round(megapixels * 1e6 / height)))
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    pixels[:, :width // 3, 2] = 255
+    pixels[:, :width // 3, :2] //= 4
+    return pixels
+
+
+@contextlib.contextmanager
+def preloaded(images):
+    """
+    Make SimpleImage(filename) in imageexample and bluescreen return a
+    copy of images[filename], so file-based functions can be timed
+    without decoding.
+    """
+    def load(filename):
+        return SimpleImage.from_array(images[filename].copy())
+    saved = imageexample.SimpleImage, bluescreen.SimpleImage
+    imageexample.SimpleImage = bluescreen.SimpleImage = load
+    try:
+        yield
+    finally:
+        imageexample.SimpleImage, bluescreen.SimpleImage = saved
+
+
+# Per-pixel bodies for the parallel mode; module-level so processes can run them
+
+def _darker_pixel(pixel):
+    pixel.red = pixel.red // 2
+    pixel.green = pixel.green // 2
+    pixel.blue = pixel.blue // 2
+
+
+def _red_channel_pixel(pixel):
+    pixel.green = 0
+    pixel.blue = 0
+
+
+def _right_half_darker_pixel(pixel, half_width):
+    if pixel.x >= half_width:
+        pixel.red *= 0.5
+        pixel.green *= 0.5
+        pixel.blue *= 0.5
+
+
+def _grayscale_pixel(pixel):
+    gray = (pixel.red + pixel.green + pixel.blue) / 3
+    pixel.red = gray
+    pixel.green = gray
+    pixel.blue = gray
+
+
+def _load(filename):
+    # Through imageexample, so preloaded() applies here too
+    return imageexample.SimpleImage(filename)
+
+
+def _parallel(pixel_func):
+    def run(filename):
+        image = _load(filename)
+        image.map_rows(pixel_func, use_processes=True)
+        return image
+    return run
+
+
+def _darker_fused(filename):
+    image = _load(filename)
+    image.ops().floor_divide(2)
+    return image.array
+
+
+def _grayscale_fused(filename):
+    image = _load(filename)
+    image.ops().grayscale()
+    return image.array
+
+
+def _in_place(func):
+    """Adapt darker-style func(image) to take a filename like the others."""
+    def run(filename):
+        image = _load(filename)
+        func(image)
+        return image
+    return run
+
+
+def operations(width):
+    """{op: {mode: func(filename)}} for everything benchmarked."""
+    return {
+        'darker': {
+            'pixel': _in_place(imageexample.darker),
+            'vectorized': _in_place(imageexample.darker_vectorized),
+            'lut': _in_place(imageexample.darker_lut),
+            'fused': _darker_fused,
+            'parallel': _parallel(_darker_pixel),
+        },
+        'red_channel': {
+            'pixel': imageexample.red_channel,
+            'vectorized': imageexample.red_channel_vectorized,
+            'parallel': _parallel(_red_channel_pixel),
+        },
+        'right_half_darker': {
+            'pixel': imageexample.right_half_darker,
+            'vectorized': imageexample.right_half_darker_vectorized,
+            'parallel': _parallel(functools.partial(_right_half_darker_pixel,
+                                                    half_width=width // 2)),
+        },
+        'grayscale': {
+            'pixel': imageexample.grayscale,
+            'vectorized': imageexample.grayscale_vectorized,
+            'fused': _grayscale_fused,
+            'parallel': _parallel(_grayscale_pixel),
+        },
+        'bluescreen': {
+            'pixel': lambda f: bluescreen.bluescreen(f, 'back'),
+            'vectorized': lambda f: bluescreen.bluescreen_vectorized(f, 'back'),
+        },
+    }
+
+
+def time_call(func, arg, repeat):
+    """Best of repeat wall-clock times for func(arg), in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak_memory(func, arg):
+    """Peak traced allocation during func(arg), in bytes."""
+    tracemalloc.start()
+    try:
+        func(arg)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _in_pixel_python(mode):
+    return mode in ('pixel', 'parallel')
+
+
+def run_benchmarks(sizes, modes=None, ops=None, repeat=3, pixel_max_mp=1.0, memory=True):
+    """Run every selected op/mode at each size and return a list of result dicts."""
+    back = synthetic_image(0.05, seed=1)
+    results = []
+    for megapixels in sizes:
+        pixels = synthetic_image(megapixels)
+        height, width = pixels.shape[:2]
+        actual_mp = height * width / 1e6
+        with preloaded({'front': pixels, 'back': back}):
+            for op, op_modes in operations(width).items():
+                if ops and op not in ops:
+                    continue
+                for mode, func in op_modes.items():
+                    if modes and mode not in modes:
+                        continue
+                    if _in_pixel_python(mode) and megapixels > pixel_max_mp:
+                        continue
+                    runs = 1 if _in_pixel_python(mode) else repeat
+                    seconds = time_call(func, 'front', runs)
+                    result = {
+                        'op': op,
+                        'mode': mode,
+                        'megapixels': megapixels,
+                        'width': width,
+                        'height': height,
+                        'seconds': seconds,
+                        'mp_per_s': actual_mp / seconds,
+                        'peak_mb': None,
+                    }
+                    if memory:
+                        result['peak_mb'] = peak_memory(func, 'front') / 1e6
+                    results.append(result)
+                    print_result(result)
+    return results
+
+
+def print_result(result):
+    peak = '' if result['peak_mb'] is None else '{:9.1f} MB'.format(result['peak_mb'])
+    print('{:>18} {:>10} {:6.1f} MP {:10.4f} s {:10.1f} MP/s {}'.format(
+        result['op'], result['mode'], result['megapixels'], result['seconds'],
+        result['mp_per_s'], peak))
+
+
+def metadata():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Results whose MP/s dropped more than tolerance (a fraction) below
+    the baseline entry with the same op, mode and size, as messages.
+    """
+    previous = {(r['op'], r['mode'], r['megapixels']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get((result['op'], result['mode'], result['megapixels']))
+        if old is None:
+            continue
+        if result['mp_per_s'] < old['mp_per_s'] * (1 - tolerance):
+            regressions.append('{} {} {} MP: {:.1f} MP/s vs baseline {:.1f} MP/s'.format(
+                result['op'], result['mode'], result['megapixels'],
+                result['mp_per_s'], old['mp_per_s']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark SimpleImage operations.')
+    parser.add_argument('--sizes', type=float, nargs='+', default=DEFAULT_SIZES,
+                        help='image sizes in megapixels (default: 0.1 1 4 12 24)')
+    parser.add_argument('--modes', nargs='+',
+                        help='only these modes: pixel vectorized lut fused parallel')
+    parser.add_argument('--ops', nargs='+', help='only these operations')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per timing, best is kept (pixel modes run once)')
+    parser.add_argument('--pixel-max-mp', type=float, default=1.0,
+                        help='largest size to run the pixel-loop modes at')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the extra tracemalloc run per measurement')
+    parser.add_argument('--output', help='write results as JSON here')
+    parser.add_argument('--save-baseline', metavar='PATH', help='write results as a baseline')
+    parser.add_argument('--baseline', metavar='PATH', help='compare against this baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed MP/s drop vs baseline, as a fraction (default 0.25)')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.modes, args.ops, args.repeat,
+                             args.pixel_max_mp, not args.no_memory)
+    report = {'meta': metadata(), 'results': results}
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print('Saved ' + path)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for message in regressions:
+            print('REGRESSION: ' + message)
+        if regressions:
+            sys.exit(1)
+        print('No regressions against ' + args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,12 +5,33 @@ This program shows an example of "greenscreening" (actually
 "bluescreening" in this case).  This is where we replace the
 pixels of a certain color intensity in a particular channel
 (here, we use blue) with the pixels from another image.
+
+bluescreen() is the pixel-by-pixel version. bluescreen_vectorized()
+and BlueScreenBatch do the same thing with whole-array operations;
+the batch form keys many foreground images against one background:
+
+  python bluescreen.py --batch OUT_DIR --background flower.png shot1.jpg shot2.jpg ...
+
+ChromaKeyer applies the same test to video frames (needs opencv-python):
+
+  python bluescreen.py --video 0                                  # webcam
+  python bluescreen.py --video in.mp4 --output out.mp4 --headless
 """
 
 
+import argparse
+import collections
 import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 from simpleimage import SimpleImage
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.profiling import NULL_PROFILER, add_profile_args, profiler_from_args
+
 # Get the directory where this script is located
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -46,12 +67,271 @@ def bluescreen(main_filename, back_filename):
     return image
 
 
+def blue_mask(red, green, blue, threshold=INTENSITY_THRESHOLD):
+    """
+    Array version of the "sufficiently blue" test in bluescreen():
+    True wherever blue is above threshold times the RGB average.
+    The channels are passed separately so RGB and BGR data both work.
+    """
+    average = (red.astype(np.float64) + green + blue) / 3
+    return blue > average * threshold
+
+
+def tile_background(back, height, width):
+    """
+    Repeat the (h, w, 3) back array to cover height x width, the same
+    x % back.width, y % back.height lookup bluescreen() does per pixel.
+    """
+    rows = np.arange(height) % back.shape[0]
+    cols = np.arange(width) % back.shape[1]
+    return back[rows[:, np.newaxis], cols]
+
+
+def composite(front, back, mask):
+    """Copy back into front wherever mask is True, in place."""
+    np.copyto(front, back, where=mask[:, :, np.newaxis])
+
+
+def bluescreen_vectorized(main_filename, back_filename):
+    """
+    Same result as bluescreen(), computed with whole-array
+    operations instead of a loop over Pixels.
+    """
+    return BlueScreenBatch(back_filename).key_file(main_filename)
+
+
+class BlueScreenBatch(object):
+    """
+    Bluescreens any number of images against one background.
+    The background is decoded once, and tiled once for each
+    foreground size seen, so a job of same-sized shots only
+    pays for the mask and the copy per image.
+    """
+    def __init__(self, back_filename, threshold=INTENSITY_THRESHOLD):
+        self.back = SimpleImage(back_filename).array
+        self.threshold = threshold
+        self._tiled = {}  # (height, width) -> tiled background
+
+    def tiled_background(self, height, width):
+        """The background tiled to height x width, built on first use."""
+        key = (height, width)
+        if key not in self._tiled:
+            self._tiled[key] = tile_background(self.back, height, width)
+        return self._tiled[key]
+
+    def key_image(self, image):
+        """Bluescreen the SimpleImage in place and return it."""
+        pixels = image.array
+        mask = blue_mask(pixels[:, :, 0], pixels[:, :, 1], pixels[:, :, 2],
+                         self.threshold)
+        composite(pixels, self.tiled_background(image.height, image.width), mask)
+        return image
+
+    def key_file(self, filename):
+        """Load filename, bluescreen it and return the result."""
+        return self.key_image(SimpleImage(filename))
+
+    def key_files(self, filenames, workers=1):
+        """
+        Generator of bluescreened images for filenames, in order.
+        With workers > 1, files are decoded and keyed on a thread pool
+        (decoding and the array math both release the GIL). Only about
+        2 x workers files are in flight at once, so keyed images don't
+        pile up in memory when the caller saves slower than they arrive.
+        """
+        if workers <= 1:
+            for filename in filenames:
+                yield self.key_file(filename)
+            return
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for filename in filenames:
+                pending.append(pool.submit(self.key_file, filename))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+
+def batch_output_paths(filenames, output_dir):
+    """
+    PNG paths in output_dir for filenames, keeping each file's path
+    relative to the inputs' common directory, so shots with the same
+    name from different directories don't overwrite each other.
+    """
+    if not filenames:
+        return []
+    folders = [os.path.dirname(os.path.abspath(filename)) for filename in filenames]
+    root = os.path.commonpath(folders)
+    return [os.path.join(output_dir, os.path.relpath(folder, root),
+                         os.path.splitext(os.path.basename(filename))[0] + '.png')
+            for filename, folder in zip(filenames, folders)]
+
+
+def run_batch(filenames, back_filename, output_dir, workers=1):
+    """Bluescreen every file in filenames, saving results as PNGs under output_dir."""
+    output_paths = [os.path.normpath(path) for path in batch_output_paths(filenames, output_dir)]
+    seen = {}
+    for filename, output_path in zip(filenames, output_paths):
+        if output_path in seen:
+            # Only possible for e.g. shot.jpg and shot.png side by side
+            raise Exception('{} and {} would both be saved as {}'.format(
+                seen[output_path], filename, output_path))
+        seen[output_path] = filename
+    batch = BlueScreenBatch(back_filename)
+    for output_path, image in zip(output_paths, batch.key_files(filenames, workers)):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        image.save(output_path)
+        print('Saved ' + output_path)
+
+
+class ChromaKeyer(object):
+    """
+    Bluescreens a stream of same-sized video frames (BGR, as OpenCV
+    delivers them) against one background. The background is tiled to
+    the frame size up front and every intermediate lives in a buffer
+    allocated here, so key() allocates nothing per frame.
+    """
+    def __init__(self, back, height, width, threshold=INTENSITY_THRESHOLD):
+        self.back = tile_background(back, height, width)
+        self.threshold = threshold
+        self._limit = np.empty((height, width), dtype=np.float64)
+        self._mask = np.empty((height, width), dtype=bool)
+        self.output = np.empty((height, width, 3), dtype=np.uint8)
+
+    def key(self, frame):
+        """
+        Key one BGR frame, returning the output buffer (which is
+        overwritten by the next call). The test is blue_mask()'s, with
+        the same float64 operations in the same order, so every pixel
+        keys exactly as it does in bluescreen().
+        """
+        blue, green, red = frame[:, :, 0], frame[:, :, 1], frame[:, :, 2]
+        np.add(red, green, out=self._limit, dtype=np.float64)
+        np.add(self._limit, blue, out=self._limit)
+        np.divide(self._limit, 3, out=self._limit)
+        np.multiply(self._limit, self.threshold, out=self._limit)
+        np.greater(blue, self._limit, out=self._mask)
+        np.copyto(self.output, frame)
+        composite(self.output, self.back, self._mask)
+        return self.output
+
+
+class FpsMeter(object):
+    """Sustained frames/second: over the whole run and over the last window frames."""
+    def __init__(self, window=60):
+        self.frames = 0
+        self.start = time.perf_counter()
+        self._times = collections.deque(maxlen=window)
+
+    def tick(self):
+        self.frames += 1
+        self._times.append(time.perf_counter())
+
+    @property
+    def rolling(self):
+        if len(self._times) < 2:
+            return 0.0
+        return (len(self._times) - 1) / (self._times[-1] - self._times[0])
+
+    @property
+    def overall(self):
+        elapsed = time.perf_counter() - self.start
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+
+def chroma_key_video(source, back_filename, output_path=None, headless=False,
+                     threshold=INTENSITY_THRESHOLD, profiler=NULL_PROFILER):
+    """
+    Bluescreen a live camera (source is an int index) or a video file
+    onto back_filename. Writes the keyed frames to output_path if given;
+    headless skips the preview window. Returns the overall frames/second.
+    """
+    import cv2  # only the video mode needs OpenCV
+
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        print('ERROR: Could not open video source {}'.format(source))
+        return 0.0
+    back = cv2.imread(back_filename)
+    if back is None:
+        print('ERROR: Could not read background {}'.format(back_filename))
+        cap.release()
+        return 0.0
+
+    ret, frame = cap.read()
+    if not ret:
+        print('ERROR: Failed to read first frame.')
+        cap.release()
+        return 0.0
+    height, width = frame.shape[:2]
+    keyer = ChromaKeyer(back, height, width, threshold)
+
+    writer = None
+    if output_path:
+        source_fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'),
+                                 source_fps, (width, height))
+
+    meter = FpsMeter()
+    while ret:
+        keyed = keyer.key(frame)
+        meter.tick()
+        profiler.frame()
+        if writer is not None:
+            writer.write(keyed)
+        if not headless:
+            cv2.putText(keyed, 'FPS: {:.1f}'.format(meter.rolling), (10, 25),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+            cv2.imshow("Bluescreen - Press 'q' to quit", keyed)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+        elif meter.frames % 100 == 0:
+            print('{} frames, {:.1f} FPS'.format(meter.frames, meter.rolling))
+        ret, frame = cap.read(frame)  # decode into the same buffer
+
+    cap.release()
+    if writer is not None:
+        writer.release()
+        print('Saved ' + output_path)
+    if not headless:
+        cv2.destroyAllWindows()
+    print('Keyed {} frames at {:.1f} FPS sustained'.format(meter.frames, meter.overall))
+    return meter.overall
+
+
 def main():
     """
     Run your desired image manipulation functions here.
     You should store the return value (image) and then
     call .show() to visualize the output of your program.
     """
+    parser = argparse.ArgumentParser(description='Bluescreen images onto a background.')
+    parser.add_argument('--batch', metavar='OUT_DIR',
+                        help='bluescreen the given images into OUT_DIR and exit')
+    parser.add_argument('--background', default=os.path.join(SCRIPT_DIR, 'images', 'flower.png'),
+                        help='background image (default: images/flower.png)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='threads for --batch (default: one per CPU)')
+    parser.add_argument('--video', metavar='SOURCE',
+                        help='bluescreen a camera index or video file instead')
+    parser.add_argument('--output', help='with --video, write the keyed video here')
+    parser.add_argument('--headless', action='store_true',
+                        help='with --video, do not open a preview window')
+    parser.add_argument('images', nargs='*', help='foreground images for --batch')
+    add_profile_args(parser)
+    args = parser.parse_args()
+    profiler = profiler_from_args('bluescreen', args)  # results are written at exit
+
+    if args.batch:
+        run_batch(args.images, args.background, args.batch, args.workers)
+        return
+    if args.video is not None:
+        source = int(args.video) if args.video.isdigit() else args.video
+        chroma_key_video(source, args.background, args.output, args.headless,
+                         profiler=profiler)
+        return
+
     # Build paths to images
     musk_path = os.path.join(SCRIPT_DIR, 'images', 'musk.jpg')
     flower_path = os.path.join(SCRIPT_DIR, 'images', 'flower.png')
@@ -67,7 +347,7 @@ def main():
 
     # Save output
     output_path = os.path.join(SCRIPT_DIR, 'outputs', 'bluescreen_result.png')
-    result.pil_image.save(output_path)
+    result.save(output_path)
 
 
 if __name__ == '__main__':
@@ -6,7 +6,11 @@ manipulate an image to show how the SimpleImage library works.
 """
 
 import os
-from simpleimage import SimpleImage
+import sys
+from simpleimage import SimpleImage, get_lut
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.profiling import profile_script
 
 # Get the directory where this script is located
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -57,6 +61,49 @@ def right_half_darker(filename):
     return image
 
 
+def darker_vectorized(image):
+    """
+    Same result as darker(), but halves each whole channel
+    in one step instead of visiting every pixel.
+    """
+    image.red //= 2
+    image.green //= 2
+    image.blue //= 2
+
+
+def darker_lut(image):
+    """
+    Same result as darker(), looking each value up
+    in a prebuilt halving table.
+    """
+    half = get_lut('floor_divide', 2)
+    image.apply_lut(half, half, half)
+
+
+def red_channel_vectorized(filename):
+    """
+    Same result as red_channel(), zeroing the green and blue
+    channels of the whole image at once.
+    """
+    image = SimpleImage(filename)
+    image.green = 0
+    image.blue = 0
+    return image
+
+
+def right_half_darker_vectorized(filename):
+    """
+    Same result as right_half_darker(), but only the right-half
+    region of each channel is scaled, in one step per channel.
+    """
+    image = SimpleImage(filename)
+    right_half = (slice(None), slice(image.width // 2, None))
+    image.red[right_half] *= 0.5
+    image.green[right_half] *= 0.5
+    image.blue[right_half] *= 0.5
+    return image
+
+
 def compute_luminosity(red, green, blue):
     """
     Calculates the luminosity of a pixel using NTSC formula
@@ -81,12 +128,25 @@ def grayscale(filename):
     return image
 
 
+def grayscale_vectorized(filename):
+    """
+    Same result as grayscale(), computing the average of
+    all pixels at once and setting all three channels to it.
+    """
+    image = SimpleImage(filename)
+    gray = (image.red + image.green + image.blue) / 3
+    image.set_channels(gray, gray, gray)
+    return image
+
+
 def main():
     """
     Run your desired image manipulation functions here.
     You should store the return value (image) and then
     call .show() to visualize the output of your program.
     """
+    profile_script('imageexample')
+
     # Build path to flower image
     flower_path = os.path.join(SCRIPT_DIR, 'images', 'flower.png')
 
@@ -110,7 +170,7 @@ def main():
 
     # Save output
     output_path = os.path.join(SCRIPT_DIR, 'outputs', 'grayscale_flower.png')
-    grayscale_flower_avg.pil_image.save(output_path)
+    grayscale_flower_avg.save(output_path)
 
 
 if __name__ == '__main__':
@@ -11,6 +11,10 @@ Create image:
   image = SimpleImage.blank(400, 200)   # create new image of size
   image = SimpleImage('foo.jpg')        # create from file
 
+Create smaller from file (JPEGs decode at reduced resolution)
+  image = SimpleImage('foo.jpg', scale=0.25)
+  image = SimpleImage('foo.jpg', size=(320, 240))
+
 Access size
   image.width, image.height
 
@@ -26,16 +30,50 @@ Get Pixel object at x,y
   pixel.red = 0
   pixel.blue = 255
 
+Loop over every pixel, optionally on all cores
+  for pixel in image: ...
+  image.map_rows(func)                        # func(pixel), threads
+  image.map_tiles(func, use_processes=True)   # processes, for pure-Python func
+
 Show image on screen
   image.show()
 
+Access all pixels at once as a NumPy array (no copy)
+  arr = image.array       # shape (height, width, 3), dtype uint8
+  arr[0, 0] = (255, 0, 0)  # writes straight into the image
+
+Change a whole channel at once (clamped like Pixel)
+  image.red *= 0.5
+  image.blue = 0
+  image.green[:, 100:] += 20             # just a region
+  image.set_channels(gray, gray, gray)   # all three together
+
+Map each channel through a 256-entry lookup table
+  half = get_lut('scale', 0.5)
+  image.apply_lut(half, half, half)
+
+Work on images bigger than memory, a tile at a time
+  image = SimpleImage.open_tiled('scan.ppm', mode='r+')
+  image.red *= 0.5
+  image.flush()
+
+Chain operations lazily; they run as one fused pass when next needed
+  image.ops().scale(0.5).zero('green', 'blue').grayscale()
+
 The main() function below demonstrates the above functions as a test.
 """
 
+import functools
+import numbers
+import os
 import sys
-# If the following line fails, "Pillow" needs to be installed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+# If the following lines fail, "Pillow" and "numpy" need to be installed
+import numpy as np
 from PIL import Image
 
+from tiledstore import TiledStore, write_tiled
+
 
 def clamp(num):
     """
@@ -50,6 +88,52 @@ def clamp(num):
     return num
 
 
+def clamp_array(values):
+    """
+    Array version of clamp(): truncates toward zero like int() does
+    and limits to 0..255, returning uint8. A uint8 input is returned as is.
+    """
+    values = np.asarray(values)
+    if values.dtype == np.uint8:
+        return values
+    if values.dtype.kind == 'f':
+        values = np.trunc(values)
+    return np.clip(values, 0, 255).astype(np.uint8)
+
+
+def make_lut(func):
+    """
+    Build a 256-entry lookup table by running func on each value
+    0..255 and clamping the result, just as a Pixel setter would.
+    """
+    return np.array([clamp(func(value)) for value in range(256)], dtype=np.uint8)
+
+
+# Prebuilt tables for common point operations, by name -> builder(*params)
+LUT_BUILDERS = {
+    'identity': lambda: make_lut(lambda value: value),
+    'scale': lambda factor: make_lut(lambda value: value * factor),
+    'floor_divide': lambda divisor: make_lut(lambda value: value // divisor),
+    'add': lambda amount: make_lut(lambda value: value + amount),
+    'constant': lambda constant: make_lut(lambda value: constant),
+    'invert': lambda: make_lut(lambda value: 255 - value),
+    'threshold': lambda level: make_lut(lambda value: 255 if value >= level else 0),
+    'gamma': lambda gamma: make_lut(lambda value: 255 * (value / 255) ** gamma),
+}
+
+
+@functools.lru_cache(maxsize=128)
+def get_lut(name, *params):
+    """
+    Prebuilt lookup table from LUT_BUILDERS, e.g. get_lut('scale', 0.5).
+    Tables are cached by name and params and are read-only, since the
+    same array is handed to every caller.
+    """
+    table = LUT_BUILDERS[name](*params)
+    table.flags.writeable = False
+    return table
+
+
 class Pixel(object):
     """
     A pixel at an x,y in a SimpleImage.
@@ -64,35 +148,34 @@ class Pixel(object):
     def __str__(self):
         return 'r:' + str(self.red) + ' g:' + str(self.green) + ' b:' + str(self.blue)
 
-    # Pillow image stores each pixel color as a (red, green, blue) tuple.
-    # So the functions below have to unpack/repack the tuple to change anything.
+    # The image stores its pixels in a (height, width, 3) uint8 array,
+    # so each channel is a single array element at [y, x, channel].
+    # .item() hands back a plain Python int, so arithmetic like
+    # pixel.red + pixel.green cannot wrap around at 256.
 
     @property
     def red(self):
-        return self.image.px[self._x, self._y][0]
+        return self.image._array.item(self._y, self._x, 0)
 
     @red.setter
     def red(self, value):
-        rgb = self.image.px[self._x, self._y]
-        self.image.px[self._x, self._y] = (clamp(value), rgb[1], rgb[2])
+        self.image._array[self._y, self._x, 0] = clamp(value)
 
     @property
     def green(self):
-        return self.image.px[self._x, self._y][1]
+        return self.image._array.item(self._y, self._x, 1)
 
     @green.setter
     def green(self, value):
-        rgb = self.image.px[self._x, self._y]
-        self.image.px[self._x, self._y] = (rgb[0], clamp(value), rgb[2])
+        self.image._array[self._y, self._x, 1] = clamp(value)
 
     @property
     def blue(self):
-        return self.image.px[self._x, self._y][2]
+        return self.image._array.item(self._y, self._x, 2)
 
     @blue.setter
     def blue(self, value):
-        rgb = self.image.px[self._x, self._y]
-        self.image.px[self._x, self._y] = (rgb[0], rgb[1], clamp(value))
+        self.image._array[self._y, self._x, 2] = clamp(value)
 
     @property
     def x(self):
@@ -103,6 +186,289 @@ class Pixel(object):
         return self._y
 
 
+def _channel_values(value):
+    """Unwrap a Channel into its int32 values so sums cannot wrap at 256."""
+    if isinstance(value, Channel):
+        return value.values.astype(np.int32)
+    return value
+
+
+def _binary_op(op, reflected=False):
+    def method(self, other):
+        mine, theirs = _channel_values(self), _channel_values(other)
+        return op(theirs, mine) if reflected else op(mine, theirs)
+    return method
+
+
+def _inplace_op(op):
+    def method(self, other):
+        if isinstance(self.image._pixels, TiledStore):
+            self._update_tiles(lambda current, part: op(current, part(other)))
+        else:
+            self._assign(op(_channel_values(self), _channel_values(other)))
+        return self
+    return method
+
+
+class Channel(object):
+    """
+    One color channel of a whole SimpleImage, e.g. image.red.
+    Arithmetic on it gives back a plain NumPy array of ints/floats,
+    while the in-place forms (image.red *= 0.5) write the result into
+    the image in one go, clamped the same way Pixel clamps.
+    Indexing gives a Channel for just that region (slices or a boolean
+    mask), so image.red[:, 100:] *= 0.5 only touches the right side.
+    On a tiled image (SimpleImage.open_tiled()) in-place changes run
+    tile by tile; reading .values or doing plain arithmetic still
+    builds the whole channel in memory.
+    """
+    def __init__(self, image, index, region=None):
+        self.image = image
+        self._index = index
+        self._region = region
+
+    @property
+    def values(self):
+        """The channel (or region) as a uint8 array, a view where possible."""
+        values = self.image._array[:, :, self._index]
+        if self._region is not None:
+            values = values[self._region]
+        return values
+
+    def _assign(self, values):
+        if isinstance(self.image._pixels, TiledStore):
+            self._update_tiles(lambda current, part: part(values))
+            return
+        channel = self.image._array[:, :, self._index]
+        if self._region is None:
+            channel[:, :] = clamp_array(values)
+        else:
+            channel[self._region] = clamp_array(values)
+
+    def _update_tiles(self, compute):
+        """
+        Tiled images: set the channel (or region) tile by tile to
+        compute(current, part), where current is the tile's int32 values
+        and part(value) picks out the piece of a number, Channel,
+        (height, width) array or region-shaped array that goes with them.
+        """
+        store = self.image._array
+        height, width = store.shape[:2]
+        region = self._region
+        # A lone int or slice picks rows; only arrays and bools are masks
+        if isinstance(region, (numbers.Integral, slice)) and not isinstance(region, bool):
+            region = (region, slice(None))
+        rows = cols = None
+        if isinstance(region, tuple):
+            rows, cols = region
+        for block_rows, block_cols, tile in store.blocks(rows, cols):
+            if region is None:
+                tile_key = region_key = (slice(None), slice(None))
+            elif isinstance(region, tuple):
+                tile_key, region_key = store.overlap(block_rows, block_cols, rows, cols)
+            else:
+                tile_key = region_key = np.asarray(region)[block_rows, block_cols]
+
+            def part(value):
+                if isinstance(value, Channel):
+                    if value._region is None:
+                        channel = value.image._array[block_rows, block_cols, value._index]
+                        return channel[tile_key]
+                    value = value.values
+                value = np.asarray(value)
+                if value.ndim == 0:
+                    return value
+                if value.shape[:2] == (height, width):
+                    return value[block_rows, block_cols][tile_key]
+                if not isinstance(region, tuple):
+                    raise Exception('On a tiled image, masked values must be a number '
+                                    'or a full (height, width) array')
+                # An int row or column drops that axis from region-shaped values
+                for axis, index in enumerate(region):
+                    if isinstance(index, numbers.Integral):
+                        value = np.expand_dims(value, axis)
+                return value[region_key]
+
+            channel = tile[:, :, self._index]
+            current = channel[tile_key].astype(np.int32)
+            channel[tile_key] = clamp_array(compute(current, part))
+
+    def __array__(self, dtype=None, copy=None):
+        if copy:
+            return np.array(self.values, dtype=dtype)
+        return np.asarray(self.values, dtype=dtype)
+
+    def __getitem__(self, region):
+        if self._region is not None:
+            raise Exception('Channel region cannot be indexed again')
+        return Channel(self.image, self._index, region)
+
+    def __setitem__(self, region, value):
+        # The second half of image.red[region] *= 2, which already wrote
+        if isinstance(value, Channel) and value._region is region:
+            return
+        self[region]._assign(_channel_values(value))
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    __add__ = _binary_op(np.add)
+    __radd__ = _binary_op(np.add, reflected=True)
+    __sub__ = _binary_op(np.subtract)
+    __rsub__ = _binary_op(np.subtract, reflected=True)
+    __mul__ = _binary_op(np.multiply)
+    __rmul__ = _binary_op(np.multiply, reflected=True)
+    __truediv__ = _binary_op(np.true_divide)
+    __floordiv__ = _binary_op(np.floor_divide)
+
+    __iadd__ = _inplace_op(np.add)
+    __isub__ = _inplace_op(np.subtract)
+    __imul__ = _inplace_op(np.multiply)
+    __itruediv__ = _inplace_op(np.true_divide)
+    __ifloordiv__ = _inplace_op(np.floor_divide)
+
+
+CHANNEL_NAMES = ('red', 'green', 'blue')
+
+# Bulk operations work on bands of rows about this many bytes, to stay in cache
+BAND_BYTES = 1 << 18
+
+
+class PixelOps(object):
+    """
+    A lazy chain of whole-image pixel operations, from image.ops().
+    Each method records one step and returns the chain, e.g.
+        image.ops().scale(0.5).zero('green', 'blue').grayscale()
+    Nothing runs until the pixels are next needed (get_pixel, .array,
+    show, save, ...). Then the steps run fused into one pass: runs of
+    per-channel steps are composed into a single lookup table per
+    channel, and the image is processed in cache-sized bands of rows
+    (or tile by tile, for a tiled image), so no full-size intermediate
+    is ever made. Results are the same
+    as doing each step over the whole image in turn.
+    """
+    def __init__(self, image):
+        self.image = image
+        self._steps = []
+
+    def _record(self, kind, value):
+        self._steps.append((kind, value))
+        return self
+
+    def _per_channel(self, table, channels):
+        """Record table for each named channel (all three if none named)."""
+        channels = channels or CHANNEL_NAMES
+        return self._record('lut', [table if name in channels else None
+                                    for name in CHANNEL_NAMES])
+
+    def scale(self, factor, *channels):
+        """Multiply by factor, e.g. scale(0.5) halves everything."""
+        return self._per_channel(get_lut('scale', factor), channels)
+
+    def add(self, amount, *channels):
+        """Add amount (which may be negative)."""
+        return self._per_channel(get_lut('add', amount), channels)
+
+    def floor_divide(self, divisor, *channels):
+        """Integer-divide by divisor, like pixel.red // divisor."""
+        return self._per_channel(get_lut('floor_divide', divisor), channels)
+
+    def zero(self, *channels):
+        """Set the named channels to 0, e.g. zero('green', 'blue')."""
+        return self._per_channel(get_lut('constant', 0), channels)
+
+    def invert(self, *channels):
+        """Replace each value v by 255 - v."""
+        return self._per_channel(get_lut('invert'), channels)
+
+    def threshold(self, level, *channels):
+        """255 where the value is >= level, else 0."""
+        return self._per_channel(get_lut('threshold', level), channels)
+
+    def lut(self, lut_red=None, lut_green=None, lut_blue=None):
+        """Map channels through 256-entry tables, as in SimpleImage.apply_lut()."""
+        return self._record('lut', [lut_red, lut_green, lut_blue])
+
+    def grayscale(self, weights=None):
+        """
+        Set all three channels to the average of red, green, blue,
+        or to their weighted sum if weights=(wr, wg, wb) is given.
+        """
+        return self._record('mix', weights)
+
+    def apply(self):
+        """Run the pending steps now and return the image."""
+        self.image.array  # reading the pixels runs them
+        return self.image
+
+    def _compile(self):
+        """Turn the recorded steps into stages, composing adjacent lookups."""
+        stages = []
+        for kind, value in self._steps:
+            if kind == 'lut' and stages and stages[-1][0] == 'lut':
+                previous = stages[-1][1]
+                for index, table in enumerate(value):
+                    if table is None:
+                        continue
+                    table = np.asarray(table, dtype=np.uint8)
+                    if previous[index] is not None:
+                        table = table[previous[index]]
+                    previous[index] = table
+            elif kind == 'lut':
+                stages.append((kind, [None if table is None else np.asarray(table, np.uint8)
+                                      for table in value]))
+            else:
+                stages.append((kind, value))
+        return stages
+
+    def _run(self):
+        """Apply and clear the pending steps on the image's pixels."""
+        stages = self._compile()
+        self._steps = []
+        for _, _, band in self.image._blocks():
+            for kind, value in stages:
+                if kind == 'lut':
+                    for index, table in enumerate(value):
+                        if table is not None:
+                            channel = band[:, :, index]
+                            channel[:, :] = table[channel]
+                else:
+                    if value is None:
+                        gray = band.sum(axis=2, dtype=np.int32) / 3
+                    else:
+                        gray = band.dot(np.asarray(value, dtype=np.float64))
+                    band[:, :, :] = clamp_array(gray)[:, :, np.newaxis]
+
+
+class _RegionPixel(Pixel):
+    """A Pixel in a region cut out of a bigger image, with x, y in the big image."""
+    def __init__(self, image, x, y, x0, y0):
+        super().__init__(image, x, y)
+        self._x0 = x0
+        self._y0 = y0
+
+    @property
+    def x(self):
+        return self._x + self._x0
+
+    @property
+    def y(self):
+        return self._y + self._y0
+
+
+def _map_region(func, pixels, x0, y0):
+    """
+    Worker for SimpleImage.map_rows()/map_tiles(): runs func on each
+    pixel of one region and returns the region's (changed) pixel array.
+    """
+    region = SimpleImage.from_array(pixels)
+    for y in range(region.height):
+        for x in range(region.width):
+            func(_RegionPixel(region, x, y, x0, y0))
+    return region.array
+
+
 # color tuples for background color names 'red' 'white' etc.
 BACK_COLORS = {
     'white': (255, 255, 255),
@@ -114,18 +480,26 @@ BACK_COLORS = {
 
 
 class SimpleImage(object):
-    def __init__(self, filename, width=0, height=0, back_color=None):
+    def __init__(self, filename, width=0, height=0, back_color=None, size=None, scale=None):
         """
         Create a new image. This case works: SimpleImage('foo.jpg')
         To create a blank image use SimpleImage.blank(500, 300)
+        A file can be loaded smaller with size=(width, height) or
+        scale=0.25; JPEGs are then decoded at reduced resolution.
+        File pixels are only decoded when first needed, so width and
+        height are available before paying for the decode.
         The other parameters here are for internal/experimental use.
         """
-        # Create pil_image either from file, or making blank
+        # Read just the file header now, or make the blank pixel array
         if filename:
-            self.pil_image = Image.open(filename).convert("RGB")
-            if self.pil_image.mode != 'RGB':
-                raise Exception('Image file is not RGB')
+            with Image.open(filename) as pil_image:
+                file_size = pil_image.size
+            if scale:
+                size = (max(1, round(file_size[0] * scale)), max(1, round(file_size[1] * scale)))
             self._filename = filename  # hold onto
+            self._pixels = None
+            self._ops = None
+            self._width, self._height = size or file_size
         else:
             if not back_color:
                 back_color = 'white'
@@ -133,33 +507,33 @@ class SimpleImage(object):
             if width == 0 or height == 0:
                 raise Exception('Creating blank image requires width/height but got {} {}'
                                 .format(width, height))
-            self.pil_image = Image.new('RGB', (width, height), color_tuple)
-        self.px = self.pil_image.load()
-        size = self.pil_image.size
-        self._width = size[0]
-        self._height = size[1]
-        self.curr_x = 0
-        self.curr_y = 0
+            array = np.empty((height, width, 3), dtype=np.uint8)
+            array[:, :] = color_tuple
+            self._set_array(array)
+
+    def _decode(self):
+        """Decode the file at the current width x height."""
+        size = (self._width, self._height)
+        with Image.open(self._filename) as file_image:
+            if file_image.size != size:
+                # JPEG decodes straight to 1/2, 1/4 or 1/8 size; other formats ignore this
+                file_image.draft('RGB', size)
+            pil_image = file_image.convert("RGB")
+        if pil_image.mode != 'RGB':
+            raise Exception('Image file is not RGB')
+        if pil_image.size != size:
+            pil_image = pil_image.resize(size)
+        # Not _set_array(), which would drop ops() steps recorded before now
+        self._pixels = np.array(pil_image, dtype=np.uint8)
 
     def __iter__(self):
-        return self
-
-    def __next__(self):
-        if self.curr_x < self.width and self.curr_y < self.height:
-            x = self.curr_x
-            y = self.curr_y
-            self.increment_curr_counters()
-            return Pixel(self, x, y)
-        else:
-            self.curr_x = 0
-            self.curr_y = 0
-            raise StopIteration()
-
-    def increment_curr_counters(self):
-        self.curr_x += 1
-        if self.curr_x == self.width:
-            self.curr_x = 0
-            self.curr_y += 1
+        """
+        Each loop over the image gets its own iterator,
+        so loops over the same image can nest or overlap.
+        """
+        for y in range(self._height):
+            for x in range(self._width):
+                yield Pixel(self, x, y)
 
     @classmethod
     def blank(cls, width, height, back_color=None):
@@ -167,9 +541,197 @@ class SimpleImage(object):
         return SimpleImage('', width, height, back_color=back_color)
 
     @classmethod
-    def file(cls, filename):
+    def file(cls, filename, size=None, scale=None):
         """Create a new image based on a file, alternative to raw constructor."""
-        return SimpleImage(filename)
+        return SimpleImage(filename, size=size, scale=scale)
+
+    @classmethod
+    def from_array(cls, array):
+        """
+        Create an image around a (height, width, 3) uint8 RGB array.
+        A C-contiguous uint8 array is used as is, without copying.
+        """
+        image = cls.__new__(cls)
+        image._set_array(array)
+        return image
+
+    @classmethod
+    def open_tiled(cls, filename, mode='r', tile_size=256, cache_tiles=64,
+                   width=None, height=None, offset=0):
+        """
+        Open an image without loading it into memory: a binary PPM,
+        a file written by save_tiled(), or (given width and height) a
+        headerless raw RGB file. Pixels are read and written through
+        tile_size squares, at most cache_tiles of them in memory at once.
+        Use mode='r+' to allow changes, which reach the file on flush().
+        A plain-text PPM cannot be mapped and is loaded normally instead.
+        """
+        if width is None:
+            with open(filename, 'rb') as f:
+                if f.read(2) == b'P3':
+                    return cls(filename)
+        store = TiledStore.open(filename, mode, tile_size, cache_tiles, width, height, offset)
+        image = cls.__new__(cls)
+        image._set_array(store)
+        return image
+
+    def _set_array(self, array):
+        """
+        Install array as the pixel storage, updating width/height to match.
+        Any pending ops() steps belonged to the old pixels and are dropped.
+        """
+        if not isinstance(array, TiledStore):
+            array = np.ascontiguousarray(array, dtype=np.uint8)
+        if array.ndim != 3 or array.shape[2] != 3:
+            raise Exception('Image array must have shape (height, width, 3) but got {}'
+                            .format(array.shape))
+        self._pixels = array
+        self._ops = None
+        self._height, self._width = array.shape[:2]
+
+    @property
+    def _array(self):
+        """The pixel storage, after decoding and running any pending ops() steps."""
+        if self._pixels is None:
+            self._decode()
+        if self._ops is not None and self._ops._steps:
+            self._ops._run()
+        return self._pixels
+
+    def ops(self):
+        """
+        The image's lazy operation chain (see PixelOps): steps recorded
+        on it run together, fused, the next time the pixels are needed.
+        """
+        if self._ops is None:
+            self._ops = PixelOps(self)
+        return self._ops
+
+    @property
+    def array(self):
+        """
+        The pixels as a (height, width, 3) uint8 NumPy array in RGB order.
+        This is the image's own storage, not a copy, so writes to it
+        show up in the image (and in any Pixel looking at it).
+        For a tiled image it is the TiledStore, indexed the same way.
+        """
+        return self._array
+
+    def _blocks(self, write=True):
+        """
+        The pixels in pieces as (rows, cols, block), block being a view:
+        cache-sized bands of rows, or the tiles of a tiled image.
+        Pass write=False when only reading.
+        """
+        pixels = self._pixels
+        if isinstance(pixels, TiledStore):
+            yield from pixels.blocks(write=write)
+            return
+        height, width = pixels.shape[:2]
+        band_height = max(1, BAND_BYTES // (width * 3))
+        for y in range(0, height, band_height):
+            rows = slice(y, min(y + band_height, height))
+            yield rows, slice(0, width), pixels[rows]
+
+    def flush(self):
+        """Write changed tiles of a tiled image back to its file."""
+        pixels = self._array
+        if isinstance(pixels, TiledStore):
+            pixels.flush()
+
+    def save_tiled(self, filename, tile_size=256):
+        """
+        Save in the tiled format that open_tiled() reads, one piece
+        at a time, so a tiled image can be converted without loading it.
+        """
+        self._array  # run any pending ops first
+        write_tiled(filename, self._width, self._height, tile_size, self._blocks(write=False))
+
+    @property
+    def pil_image(self):
+        """A PIL copy of the pixels, built fresh on each access."""
+        return Image.fromarray(np.asarray(self._array), 'RGB')
+
+    @pil_image.setter
+    def pil_image(self, pil_image):
+        self._set_array(np.array(pil_image.convert('RGB'), dtype=np.uint8))
+
+    def _set_channel(self, index, value):
+        # image.red *= 0.5 ends by assigning the same Channel back; already written
+        if isinstance(value, Channel) and value.image is self and \
+                value._index == index and value._region is None:
+            return
+        Channel(self, index)._assign(_channel_values(value))
+
+    @property
+    def red(self):
+        """The red channel of the whole image, see Channel."""
+        return Channel(self, 0)
+
+    @red.setter
+    def red(self, value):
+        self._set_channel(0, value)
+
+    @property
+    def green(self):
+        """The green channel of the whole image, see Channel."""
+        return Channel(self, 1)
+
+    @green.setter
+    def green(self, value):
+        self._set_channel(1, value)
+
+    @property
+    def blue(self):
+        """The blue channel of the whole image, see Channel."""
+        return Channel(self, 2)
+
+    @blue.setter
+    def blue(self, value):
+        self._set_channel(2, value)
+
+    def set_channels(self, red=None, green=None, blue=None, mask=None):
+        """
+        Set red/green/blue for the whole image in one step, each given as a
+        number or a (height, width) array; None leaves that channel alone.
+        All values are read before any are written, so swapping channels
+        works. mask limits the change to a region: a boolean (height, width)
+        array or a slice like numpy.s_[:, 100:].
+        """
+        clamped = {}  # set_channels(gray, gray, gray) only clamps gray once
+        values = []
+        for value in (red, green, blue):
+            if value is not None:
+                if id(value) not in clamped:
+                    if isinstance(value, Channel):
+                        array = np.array(value)  # copy, since we may overwrite it
+                    else:
+                        array = clamp_array(value)
+                    if mask is not None and array.ndim == 2 and \
+                            not isinstance(self._pixels, TiledStore):
+                        array = array[mask]
+                    clamped[id(value)] = array
+                value = clamped[id(value)]
+            values.append(value)
+        for index, value in enumerate(values):
+            if value is not None:
+                Channel(self, index, mask)._assign(value)
+
+    def apply_lut(self, lut_red=None, lut_green=None, lut_blue=None):
+        """
+        Replace every value in each channel by its entry in a 256-entry
+        uint8 lookup table (see make_lut() and get_lut()); None leaves
+        that channel alone. One table lookup per value, no clamping
+        or float math.
+        """
+        self._array  # run any pending ops first
+        tables = [None if table is None else np.asarray(table, dtype=np.uint8)
+                  for table in (lut_red, lut_green, lut_blue)]
+        for _, _, block in self._blocks():
+            for index, table in enumerate(tables):
+                if table is not None:
+                    channel = block[:, :, index]
+                    channel[:, :] = table[channel]
 
     @property
     def width(self):
@@ -197,7 +759,7 @@ class SimpleImage(object):
             e = Exception('set_pixel bad coordinate x %d y %d (vs. image width %d height %d)' %
                           (x, y, self._width, self.height))
             raise e
-        self.px[x, y] = (pixel.red, pixel.green, pixel.blue)
+        self._array[y, x] = (pixel.red, pixel.green, pixel.blue)
 
     def set_rgb(self, x, y, red, green, blue):
         """
@@ -205,27 +767,77 @@ class SimpleImage(object):
         the given red/green/blue values without
         requiring a separate pixel object.
         """
-        self.px[x, y] = (red, green, blue)
+        self._array[y, x] = (red, green, blue)
 
     def _get_pix_(self, x, y):
         """Get pix RGB tuple (200, 100, 50) for the given x,y."""
-        return self.px[x, y]
+        return tuple(self._array[y, x].tolist())
 
     def _set_pix_(self, x, y, pix):
         """Set the given pix RGB tuple into the image at the given x,y."""
-        self.px[x, y] = pix
+        self._array[y, x] = pix
+
+    def map_rows(self, func, band_height=None, workers=None, use_processes=False):
+        """
+        Call func(pixel) on every pixel, like the body of a for loop over the
+        image, with the rows split into bands that run on a pool of workers.
+        Threads suit func that mostly calls into numpy; pure-Python func needs
+        use_processes=True to use more than one core (func must then be a
+        module-level function so it can be sent to the worker processes).
+        Each band is written back by exactly one worker, so no updates are lost.
+        """
+        workers = workers or os.cpu_count() or 1
+        if not band_height:
+            band_height = -(-self._height // (workers * 4))  # ~4 bands per worker
+        regions = [(y, min(y + band_height, self._height), 0, self._width)
+                   for y in range(0, self._height, band_height)]
+        self._map_regions(func, regions, workers, use_processes)
+
+    def map_tiles(self, func, tile_size=256, workers=None, use_processes=False):
+        """
+        Like map_rows(), but splits the image into tile_size x tile_size squares
+        (or (width, height) if tile_size is a pair).
+        """
+        tile_w, tile_h = tile_size if isinstance(tile_size, tuple) else (tile_size, tile_size)
+        regions = [(y, min(y + tile_h, self._height), x, min(x + tile_w, self._width))
+                   for y in range(0, self._height, tile_h)
+                   for x in range(0, self._width, tile_w)]
+        self._map_regions(func, regions, workers or os.cpu_count() or 1, use_processes)
+
+    def _map_regions(self, func, regions, workers, use_processes):
+        if use_processes:
+            executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers)
+        with executor:
+            futures = {}
+            for y0, y1, x0, x1 in regions:
+                # Processes get a pickled copy of the region, threads a view
+                future = executor.submit(_map_region, func, self._array[y0:y1, x0:x1], x0, y0)
+                futures[future] = (y0, y1, x0, x1)
+            pixels = self._array
+            for future in as_completed(futures):
+                y0, y1, x0, x1 = futures[future]
+                result = future.result()
+                # A thread that worked on a view of the pixels has already written them
+                if not (isinstance(pixels, np.ndarray) and np.may_share_memory(result, pixels)):
+                    pixels[y0:y1, x0:x1] = result
 
     def show(self):
         """Displays the image using an external utility."""
         self.pil_image.show()
 
+    def save(self, filename):
+        """Saves the image to filename; the format comes from the extension."""
+        self.pil_image.save(filename)
+
     def make_as_big_as(self, image):
         """Resizes image to the shape of the given image"""
+        if self._pixels is None:
+            # Not decoded yet, so decode straight to the new size
+            self._width, self._height = image.width, image.height
+            return
         self.pil_image = self.pil_image.resize((image.width, image.height))
-        self.px = self.pil_image.load()
-        size = self.pil_image.size
-        self._width = size[0]
-        self._height = size[1]
 
 
 def main():
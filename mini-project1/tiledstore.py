@@ -0,0 +1,287 @@
+"""
+File: tiledstore.py
+-------------------
+Pixel storage for images too big to hold in memory, used by
+SimpleImage.open_tiled(). The pixels stay in a file mapped with
+np.memmap and are read and written in fixed-size square tiles, of
+which only a bounded number are kept in memory at a time.
+
+Two file layouts are supported:
+- raster: rows of RGB bytes one after another, as in a binary (P6)
+  PPM file or a headerless .raw/.rgb file
+- tiled: the SimpleImage tiled format written by write_tiled(), where
+  each tile's bytes are contiguous in the file, so loading a tile is
+  one sequential read
+"""
+
+import collections
+import numbers
+
+import numpy as np
+
+TILED_MAGIC = b'SITILED1'
+TILED_HEADER_BYTES = 32  # magic, then width, height, tile size as uint32
+
+
+def read_ppm_header(filename):
+    """
+    Parse a PPM header. Returns (magic, width, height, data_offset),
+    where magic is b'P6' (binary) or b'P3' (plain text).
+    """
+    with open(filename, 'rb') as f:
+        data = f.read(1024)
+    tokens = []
+    pos = 0
+    while len(tokens) < 4:
+        if pos >= len(data):
+            raise Exception('{} is not a PPM file'.format(filename))
+        if data[pos:pos + 1] == b'#':  # comment to end of line
+            pos = data.index(b'\n', pos)
+        elif data[pos:pos + 1].isspace():
+            pos += 1
+        else:
+            start = pos
+            while pos < len(data) and not data[pos:pos + 1].isspace():
+                pos += 1
+            tokens.append(data[start:pos])
+    magic = tokens[0]
+    if magic not in (b'P3', b'P6'):
+        raise Exception('{} is not an RGB PPM file'.format(filename))
+    if int(tokens[3]) > 255:
+        raise Exception('{} has 16-bit samples, only 8-bit PPM is supported'.format(filename))
+    # Exactly one whitespace byte separates the header from the pixel data
+    return magic, int(tokens[1]), int(tokens[2]), pos + 1
+
+
+def write_tiled(filename, width, height, tile_size, blocks=()):
+    """
+    Create a file in the tiled format for a width x height image.
+    blocks yields (rows, cols, pixels) pieces to copy in, e.g. from
+    SimpleImage._blocks(); anything not covered is left black.
+    """
+    tiles_y = -(-height // tile_size)
+    tiles_x = -(-width // tile_size)
+    header = np.zeros(TILED_HEADER_BYTES, dtype=np.uint8)
+    header[:len(TILED_MAGIC)] = np.frombuffer(TILED_MAGIC, dtype=np.uint8)
+    header[8:20] = np.array([width, height, tile_size], dtype='<u4').view(np.uint8)
+    with open(filename, 'wb') as f:
+        f.write(header.tobytes())
+        f.truncate(TILED_HEADER_BYTES + tiles_y * tiles_x * tile_size * tile_size * 3)
+    store = TiledStore.open(filename, mode='r+')
+    for rows, cols, pixels in blocks:
+        store[rows, cols] = pixels
+    store.flush()
+
+
+class TiledStore(object):
+    """
+    A (height, width, 3) uint8 image in a memory-mapped file, read and
+    written through tile_size x tile_size tiles. At most cache_tiles tiles
+    are held in memory; the least recently used one is dropped first,
+    and written back to the file if it was changed.
+
+    Indexing follows NumPy for the forms SimpleImage uses:
+    store[y, x, c] and store[y, x] read single pixels through the tile
+    cache (as copies); slicing rows/columns (any positive step) copies
+    that region out, and assigning to it writes tile by tile.
+    """
+    ndim = 3
+    dtype = np.dtype(np.uint8)
+
+    def __init__(self, tiles, height, width, tile_size, tiled, cache_tiles=64):
+        # tiles is the memmap: (height, width, 3) for raster files, or
+        # (tiles_y, tiles_x, tile_size, tile_size, 3) for the tiled format
+        self._tiles = tiles
+        self._tiled = tiled
+        self.shape = (height, width, 3)
+        self.tile_size = tile_size
+        self.cache_tiles = max(1, cache_tiles)
+        self.writable = tiles.flags.writeable
+        self._cache = collections.OrderedDict()  # (ty, tx) -> tile array
+        self._dirty = set()
+
+    @classmethod
+    def open(cls, filename, mode='r', tile_size=256, cache_tiles=64,
+             width=None, height=None, offset=0):
+        """
+        Map filename: a binary PPM, a file in the tiled format, or (given
+        width and height) a headerless raw RGB file. mode is np.memmap's:
+        'r' read-only, 'r+' to write changes back to the file.
+        """
+        with open(filename, 'rb') as f:
+            start = f.read(len(TILED_MAGIC))
+        if start == TILED_MAGIC:
+            header = np.fromfile(filename, dtype='<u4', count=5, offset=len(TILED_MAGIC))
+            width, height, tile_size = (int(v) for v in header[:3])
+            tiles_y = -(-height // tile_size)
+            tiles_x = -(-width // tile_size)
+            tiles = np.memmap(filename, dtype=np.uint8, mode=mode, offset=TILED_HEADER_BYTES,
+                              shape=(tiles_y, tiles_x, tile_size, tile_size, 3))
+            return cls(tiles, height, width, tile_size, True, cache_tiles)
+        if width is None or height is None:
+            magic, width, height, offset = read_ppm_header(filename)
+            if magic != b'P6':
+                raise Exception('{} is a plain-text PPM, which cannot be memory-mapped'
+                                .format(filename))
+        tiles = np.memmap(filename, dtype=np.uint8, mode=mode, offset=offset,
+                          shape=(height, width, 3))
+        return cls(tiles, height, width, tile_size, False, cache_tiles)
+
+    def _file_tile(self, ty, tx):
+        """The memmap region backing tile (ty, tx), clipped at the image edge."""
+        size = self.tile_size
+        height = min(size, self.shape[0] - ty * size)
+        width = min(size, self.shape[1] - tx * size)
+        if self._tiled:
+            return self._tiles[ty, tx, :height, :width]
+        return self._tiles[ty * size:ty * size + height, tx * size:tx * size + width]
+
+    def tile(self, ty, tx, write=False):
+        """
+        Tile (ty, tx) as an in-memory array, loading it if needed.
+        Pass write=True when going to change it, so it is saved back.
+        """
+        if write and not self.writable:
+            raise Exception("Tiled image was opened read-only, use mode='r+' to change it")
+        key = (ty, tx)
+        tile = self._cache.get(key)
+        if tile is None:
+            tile = np.array(self._file_tile(ty, tx))
+            tile.flags.writeable = self.writable
+            self._cache[key] = tile
+            if len(self._cache) > self.cache_tiles:
+                self._evict()
+        else:
+            self._cache.move_to_end(key)
+        if write:
+            self._dirty.add(key)
+        return tile
+
+    def _evict(self):
+        key, tile = self._cache.popitem(last=False)
+        if key in self._dirty:
+            self._dirty.discard(key)
+            self._file_tile(*key)[:, :] = tile
+
+    def flush(self):
+        """Write all changed tiles back to the file."""
+        for key in self._dirty:
+            self._file_tile(*key)[:, :] = self._cache[key]
+        self._dirty.clear()
+        if self.writable:
+            self._tiles.flush()
+
+    def blocks(self, rows=None, cols=None, write=True):
+        """
+        Generator of (rows, cols, tile) for every tile, in raster order,
+        where rows/cols are the slices of the image the tile covers.
+        rows/cols (slices or ints) limit it to the tiles holding pixels
+        of that region; with a step, tiles the step skips over entirely
+        are left out.
+        """
+        height, width = self.shape[:2]
+        size = self.tile_size
+        rows = self._as_slice(slice(None) if rows is None else rows, 0)
+        cols = self._as_slice(slice(None) if cols is None else cols, 1)
+        for ty in range(height // size + (height % size > 0)):
+            block_rows = slice(ty * size, min(height, ty * size + size))
+            if self._axis_overlap(block_rows, rows) is None:
+                continue
+            for tx in range(width // size + (width % size > 0)):
+                block_cols = slice(tx * size, min(width, tx * size + size))
+                if self._axis_overlap(block_cols, cols) is None:
+                    continue
+                yield block_rows, block_cols, self.tile(ty, tx, write)
+
+    def item(self, y, x, c):
+        size = self.tile_size
+        return self.tile(y // size, x // size).item(y % size, x % size, c)
+
+    def _split_key(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (2 - len(key))
+        return key[0], key[1], key[2:]
+
+    def __getitem__(self, key):
+        rows, cols, rest = self._split_key(key)
+        size = self.tile_size
+        if isinstance(rows, numbers.Integral) and isinstance(cols, numbers.Integral):
+            rows, cols = rows % self.shape[0], cols % self.shape[1]
+            # A copy: writes to a view of a cached tile would be lost when it is evicted
+            return self.tile(rows // size, cols // size)[(rows % size, cols % size) + rest].copy()
+        # An int row or column drops that axis, as in NumPy
+        squeeze = tuple(0 if isinstance(index, numbers.Integral) else slice(None)
+                        for index in (rows, cols))
+        rows, cols = self._as_slice(rows, 0), self._as_slice(cols, 1)
+        out = np.empty((len(range(rows.start, rows.stop, rows.step)),
+                        len(range(cols.start, cols.stop, cols.step)), 3), dtype=np.uint8)
+        for block_rows, block_cols, tile in self.blocks(rows, cols, write=False):
+            src, dst = self.overlap(block_rows, block_cols, rows, cols)
+            out[dst] = tile[src]
+        return out[squeeze + rest]
+
+    def __setitem__(self, key, value):
+        rows, cols, rest = self._split_key(key)
+        size = self.tile_size
+        if isinstance(rows, numbers.Integral) and isinstance(cols, numbers.Integral):
+            rows, cols = rows % self.shape[0], cols % self.shape[1]
+            tile = self.tile(rows // size, cols // size, write=True)
+            tile[(rows % size, cols % size) + rest] = value
+            return
+        indexes = (rows, cols)
+        rows, cols = self._as_slice(rows, 0), self._as_slice(cols, 1)
+        # Broadcast value to what store[key] would be in NumPy, then put back
+        # the axes an int row or column dropped, so it lines up with the region
+        shape = tuple(len(range(s.start, s.stop, s.step))
+                      for s, index in zip((rows, cols), indexes)
+                      if not isinstance(index, numbers.Integral))
+        value = np.broadcast_to(np.asarray(value), shape + np.empty(3)[rest].shape)
+        for axis, index in enumerate(indexes):
+            if isinstance(index, numbers.Integral):
+                value = np.expand_dims(value, axis)
+        for block_rows, block_cols, tile in self.blocks(rows, cols, write=True):
+            src, dst = self.overlap(block_rows, block_cols, rows, cols)
+            tile[src + rest] = value[dst]
+
+    def _as_slice(self, index, axis):
+        """index (an int or a slice) as a slice with explicit start, stop and step."""
+        if isinstance(index, numbers.Integral):
+            index = index % self.shape[axis]
+            return slice(index, index + 1, 1)
+        start, stop, step = index.indices(self.shape[axis])
+        if step < 0:
+            raise Exception('Tiled images only support slices with a positive step')
+        return slice(start, max(start, stop), step)
+
+    @staticmethod
+    def _axis_overlap(block, region):
+        """
+        (src, dst) slices along one axis where the pixels region selects
+        fall inside block (both slices of the image, region from
+        _as_slice): src indexes the tile, dst the region. None if none do.
+        """
+        start, stop, step = region.start, region.stop, region.step
+        low = max(block.start, start)
+        first = start + -(-(low - start) // step) * step  # first selected index >= low
+        bound = min(block.stop, stop)
+        if first >= bound:
+            return None
+        count = len(range(first, bound, step))
+        offset = (first - start) // step
+        return (slice(first - block.start, bound - block.start, step),
+                slice(offset, offset + count))
+
+    def overlap(self, block_rows, block_cols, rows, cols):
+        """
+        Keys into the tile (src) and the region (dst) where they overlap.
+        rows and cols may be ints or slices with a positive step.
+        """
+        rows, cols = self._as_slice(rows, 0), self._as_slice(cols, 1)
+        row_src, row_dst = self._axis_overlap(block_rows, rows)
+        col_src, col_dst = self._axis_overlap(block_cols, cols)
+        return (row_src, col_src), (row_dst, col_dst)
+
+    def __array__(self, dtype=None, copy=None):
+        """The whole image as an array; this reads every tile."""
+        return np.asarray(self[:, :], dtype=dtype)
@@ -1,15 +1,35 @@
 """
 Mini Project 2: Real-Time Image Warping & Transformations
 Course: CS5330 - Pattern Recognition and Computer Vision
+
+Live mode (webcam window):
+    python image_warp.py
+Headless batch mode (video file or image sequence, no window):
+    python image_warp.py --input in.mp4 --output out.mp4 --transform "angle=15,scale=1.2,flip_h"
+    python image_warp.py --input frames/ --output out.mp4 --keyframes keys.json
+Animated render (keyframes interpolated, frames rendered across processes):
+    python image_warp.py --input photo.jpg --output anim.mp4 --keyframes keys.json --interpolate --workers 4
 """
 
+import argparse
 import cv2
+import json
 import numpy as np
 import time
 import os
+import sys
+import tracemalloc
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 
 # Get script directory for saving outputs
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(SCRIPT_DIR))
+
+from common import frame_source
+from common.frame_source import IMAGE_EXTENSIONS
+from common.profiling import NULL_PROFILER, add_profile_args, profiler_from_args
+from common.stage_timer import make_timer
 
 # Transformation state
 class TransformState:
@@ -26,34 +46,144 @@ class TransformState:
         self.perspective = False  # perspective warp toggle
         self.mode = "NONE"  # current mode name
 
-
-def apply_transforms(frame, state):
-    """Apply all active transformations to the frame."""
-    h, w = frame.shape[:2]
-    result = frame.copy()
-
-    # Apply flips
+    def key(self):
+        """Hashable summary of everything that affects the warp."""
+        # Rounded so 1.0 + 0.05 - 0.05 matches 1.0
+        return (self.tx, self.ty, self.angle, round(self.scale, 6),
+                self.flip_h, self.flip_v, self.perspective)
+
+
+IDENTITY_KEY = TransformState().key()
+
+# Settable TransformState fields and how to read them from text
+TRANSFORM_FIELDS = {
+    "tx": int,
+    "ty": int,
+    "angle": float,
+    "scale": float,
+    "flip_h": bool,
+    "flip_v": bool,
+    "perspective": bool,
+}
+
+
+def apply_settings(state, settings):
+    """Set TransformState fields from a {name: value} dict."""
+    for name, value in settings.items():
+        if name not in TRANSFORM_FIELDS:
+            raise ValueError(f"Unknown transform '{name}' (expected one of "
+                             f"{', '.join(TRANSFORM_FIELDS)})")
+        kind = TRANSFORM_FIELDS[name]
+        if kind is bool and isinstance(value, str):
+            value = value.lower() in ("1", "true", "yes", "on")
+        value = kind(value)
+        if kind is float and value == int(value):
+            value = int(value)  # keep "rot=15" rather than "rot=15.0" in the HUD
+        setattr(state, name, value)
+    return state
+
+
+def parse_transform_spec(spec):
+    """Parse a spec like "angle=15,scale=1.2,tx=10,flip_h" into a TransformState.
+
+    A bare name turns a flip/perspective option on.
+    """
+    settings = {}
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, value = part.partition("=")
+        settings[name.strip()] = value.strip() if value else True
+    return apply_settings(TransformState(), settings)
+
+
+def load_keyframes(path):
+    """Load a keyframe script: a JSON list of {"frame": n, <field>: value, ...}.
+
+    Each keyframe changes the listed fields from its frame onward, the
+    way a keypress would in live mode. Returns them sorted by frame.
+    """
+    with open(path) as f:
+        keyframes = json.load(f)
+    return sorted(keyframes, key=lambda keyframe: keyframe["frame"])
+
+
+def keyframe_state(keyframes, index):
+    """The TransformState in effect at frame index."""
+    state = TransformState()
+    for keyframe in keyframes:
+        if keyframe["frame"] > index:
+            break
+        apply_settings(state, {k: v for k, v in keyframe.items() if k != "frame"})
+    return state
+
+
+# Fields that ease smoothly between keyframes; the flips switch at their keyframe
+INTERPOLATED_FIELDS = ("tx", "ty", "angle", "scale", "perspective")
+
+
+def interpolated_state(keyframes, index):
+    """The TransformState at frame index, easing linearly between keyframes.
+
+    Each numeric field moves from the value at the last keyframe that set
+    it to the value at the next one; perspective is eased as a strength
+    from 0 (off) to 1 (full). A field not set at frame 0 eases from its
+    default there, and after its last keyframe it holds that value.
+    """
+    state = keyframe_state(keyframes, index)
+    defaults = TransformState()
+    for name in INTERPOLATED_FIELDS:
+        before = {"frame": 0, name: getattr(defaults, name)}
+        after = None
+        for keyframe in keyframes:
+            if name not in keyframe:
+                continue
+            if keyframe["frame"] <= index:
+                before = keyframe
+            else:
+                after = keyframe
+                break
+        if after is None:
+            continue
+        t = (index - before["frame"]) / (after["frame"] - before["frame"])
+        start, end = float(before[name]), float(after[name])
+        setattr(state, name, start + (end - start) * t)
+    return state
+
+
+def build_transform_matrix(state, w, h):
+    """Compose all active transformations into one 3x3 matrix for a w x h frame.
+
+    The order matches applying them one by one: flips, then rotation and
+    scaling about the center, then translation, then the perspective warp.
+    """
+    matrix = np.eye(3)
+
+    # Flips (same pixel mapping as cv2.flip)
     if state.flip_h:
-        result = cv2.flip(result, 1)
+        matrix = np.array([[-1, 0, w - 1], [0, 1, 0], [0, 0, 1]], dtype=np.float64) @ matrix
     if state.flip_v:
-        result = cv2.flip(result, 0)
+        matrix = np.array([[1, 0, 0], [0, -1, h - 1], [0, 0, 1]], dtype=np.float64) @ matrix
 
-    # Apply rotation and scaling
+    # Rotation and scaling
     center = (w // 2, h // 2)
     rotation_matrix = cv2.getRotationMatrix2D(center, state.angle, state.scale)
-    result = cv2.warpAffine(result, rotation_matrix, (w, h))
+    matrix = np.vstack([rotation_matrix, [0, 0, 1]]) @ matrix
 
-    # Apply translation
+    # Translation
     if state.tx != 0 or state.ty != 0:
-        translation_matrix = np.float32([[1, 0, state.tx], [0, 1, state.ty]])
-        result = cv2.warpAffine(result, translation_matrix, (w, h))
+        translation_matrix = np.array([[1, 0, state.tx], [0, 1, state.ty], [0, 0, 1]],
+                                      dtype=np.float64)
+        matrix = translation_matrix @ matrix
 
-    # Apply perspective transform
+    # Perspective transform
     if state.perspective:
         # Define source points (corners of the image)
         src_pts = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
         # Define destination points (create a perspective effect)
-        margin = int(w * 0.1)
+        # perspective may be a 0-1 strength while animating (True is full strength)
+        margin = int(w * 0.1) * float(state.perspective)
         dst_pts = np.float32([
             [margin, margin],
             [w - margin, 0],
@@ -61,9 +191,81 @@ def apply_transforms(frame, state):
             [0, h - margin]
         ])
         perspective_matrix = cv2.getPerspectiveTransform(src_pts, dst_pts)
-        result = cv2.warpPerspective(result, perspective_matrix, (w, h))
+        matrix = perspective_matrix @ matrix
+
+    return matrix
+
+
+def build_remap_tables(matrix, w, h):
+    """Build cv2.remap tables that apply matrix to a w x h frame.
+
+    Returns fixed-point maps (CV_16SC2 + interpolation table), which
+    remap faster than float maps at the same 1/32-pixel precision
+    warpAffine/warpPerspective use internally.
+    """
+    inverse = np.linalg.inv(matrix)
+    xs, ys = np.meshgrid(np.arange(w, dtype=np.float64), np.arange(h, dtype=np.float64))
+    denom = inverse[2, 0] * xs + inverse[2, 1] * ys + inverse[2, 2]
+    map_x = (inverse[0, 0] * xs + inverse[0, 1] * ys + inverse[0, 2]) / denom
+    map_y = (inverse[1, 0] * xs + inverse[1, 1] * ys + inverse[1, 2]) / denom
+    return cv2.convertMaps(map_x.astype(np.float32), map_y.astype(np.float32), cv2.CV_16SC2)
+
+
+class RemapCache:
+    """Remap tables for recently used transform states.
+
+    Tables are built only when a state is first seen; the least
+    recently used state is evicted once capacity is exceeded.
+    """
+
+    def __init__(self, capacity=8):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._tables = OrderedDict()
+
+    def get(self, state, w, h):
+        """Return (map1, map2) for state on a w x h frame."""
+        key = (state.key(), w, h)
+        tables = self._tables.get(key)
+        if tables is not None:
+            self._tables.move_to_end(key)
+            self.hits += 1
+            return tables
+
+        self.misses += 1
+        tables = build_remap_tables(build_transform_matrix(state, w, h), w, h)
+        self._tables[key] = tables
+        if len(self._tables) > self.capacity:
+            self._tables.popitem(last=False)
+        return tables
+
+
+def apply_transforms(frame, state, cache=None, dst=None):
+    """Apply all active transformations to the frame.
+
+    The transformations are composed into a single matrix and applied
+    with one warp, so the frame is resampled (and blurred) only once.
+    With a RemapCache, the warp is a cv2.remap through tables that are
+    rebuilt only when the state changes. If dst (an array or view the
+    same size as frame) is given, the result is written into it and
+    nothing new is allocated.
+    """
+    h, w = frame.shape[:2]
+    if state.key() == IDENTITY_KEY:
+        if dst is None:
+            return frame.copy()
+        np.copyto(dst, frame)
+        return dst
 
-    return result
+    if cache is not None:
+        map1, map2 = cache.get(state, w, h)
+        return cv2.remap(frame, map1, map2, cv2.INTER_LINEAR, dst=dst)
+
+    matrix = build_transform_matrix(state, w, h)
+    if not state.perspective:
+        return cv2.warpAffine(frame, matrix[:2], (w, h), dst=dst)
+    return cv2.warpPerspective(frame, matrix, (w, h), dst=dst)
 
 
 def get_mode_text(state):
@@ -87,6 +289,199 @@ def get_mode_text(state):
     return "Mode: " + " | ".join(parts)
 
 
+class AllocationMeter:
+    """Bytes allocated while processing a frame, traced with tracemalloc.
+
+    Call start() at the top of the frame and stop() at the end; bytes
+    is then the peak traced memory above the level at start(). Counts
+    NumPy arrays, including those OpenCV returns.
+    """
+
+    def __init__(self):
+        tracemalloc.start()
+        self.bytes = 0
+        self._base = 0
+
+    def start(self):
+        tracemalloc.reset_peak()
+        self._base = tracemalloc.get_traced_memory()[0]
+
+    def stop(self):
+        self.bytes = tracemalloc.get_traced_memory()[1] - self._base
+
+
+def is_still_image(path):
+    return os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def read_still(path):
+    frame = cv2.imread(path)
+    if frame is None:
+        raise IOError(f"Could not read image {path}")
+    return frame
+
+
+def iter_frames(path, count=None):
+    """Yield frames from any frame source: a video file, an image directory or
+    glob, a recorded session or a synthetic generator (see common/frame_source.py).
+
+    A single image file is yielded count times (default once), to animate
+    a still. Otherwise count, if given, stops after that many frames.
+    """
+    if is_still_image(path):
+        frame = read_still(path)
+        for _ in range(count or 1):
+            yield frame
+        return
+    yield from frame_source.iter_frames(path, count)
+
+
+def source_fps(path, default=30.0):
+    """Frame rate of a video file, or default for other sources."""
+    if not os.path.isfile(path) or is_still_image(path):
+        return default
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return fps if fps > 0 else default
+
+
+def open_writer(output_path, fps, frame):
+    """An mp4 VideoWriter for frames shaped like frame."""
+    h, w = frame.shape[:2]
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (w, h))
+    if not writer.isOpened():
+        raise IOError(f"Could not open {output_path} for writing")
+    return writer
+
+
+def run_batch(input_path, output_path, state_for_frame, fps=None, frame_count=None,
+              profiler=NULL_PROFILER, use_cache=True):
+    """Warp every frame of input_path without a window, optionally writing a video.
+
+    state_for_frame(index) gives the TransformState for each frame.
+    frame_count limits the number of frames (and sets it for a still image).
+    use_cache=False warps directly instead of through a RemapCache; use it
+    when the state changes every frame, since each new state would build
+    (and cache) full-frame tables that are never reused.
+    Prints and returns throughput: overall and warp-only frames/second.
+    """
+    fps = fps or source_fps(input_path)
+    cache = RemapCache() if use_cache else None
+    writer = None
+    transformed = None
+    frames = 0
+    warp_seconds = 0.0
+    start = time.perf_counter()
+
+    for index, frame in enumerate(iter_frames(input_path, frame_count)):
+        if transformed is None or transformed.shape != frame.shape:
+            transformed = np.empty_like(frame)
+        if output_path and writer is None:
+            writer = open_writer(output_path, fps, frame)
+
+        warp_start = time.perf_counter()
+        apply_transforms(frame, state_for_frame(index), cache, dst=transformed)
+        warp_seconds += time.perf_counter() - warp_start
+
+        if writer is not None:
+            writer.write(transformed)
+        frames += 1
+        profiler.frame()
+        if frames % 100 == 0:
+            print(f"  {frames} frames, {frames / (time.perf_counter() - start):.1f} FPS")
+
+    total_seconds = time.perf_counter() - start
+    if writer is not None:
+        writer.release()
+        print(f"Output saved: {output_path}")
+
+    stats = {
+        "frames": frames,
+        "seconds": total_seconds,
+        "fps": frames / total_seconds if total_seconds > 0 else 0.0,
+        "warp_fps": frames / warp_seconds if warp_seconds > 0 else 0.0,
+    }
+    print(f"Processed {frames} frames in {total_seconds:.2f}s: "
+          f"{stats['fps']:.1f} FPS overall, {stats['warp_fps']:.1f} FPS warp only")
+    return stats
+
+
+# Set in each render worker process by _init_render_worker
+_worker_still = None
+_worker_cache = None
+
+
+def _init_render_worker(still_path, use_cache):
+    global _worker_still, _worker_cache
+    _worker_cache = RemapCache() if use_cache else None
+    if still_path:
+        _worker_still = read_still(still_path)
+
+
+def _render_frame(frame, state):
+    """Warp one frame in a render worker (frame None means the still image)."""
+    if frame is None:
+        frame = _worker_still
+    return apply_transforms(frame, state, _worker_cache)
+
+
+def render_parallel(input_path, output_path, state_for_frame, workers,
+                    fps=None, frame_count=None, use_cache=True):
+    """Like run_batch, but render frames across a pool of worker processes.
+
+    Every frame depends only on its source frame and its state, so frames
+    are handed out to workers as they come in, and the results are put back
+    in order and streamed to the writer as soon as the next one is ready.
+    At most a few frames per worker are in flight, which bounds memory.
+    A still image is loaded once per worker instead of being sent per frame.
+    use_cache is as in run_batch.
+    """
+    fps = fps or source_fps(input_path)
+    still_path = input_path if is_still_image(input_path) else None
+    max_pending = workers * 4
+    pending = deque()
+    writer = None
+    frames = 0
+    start = time.perf_counter()
+
+    def write_next():
+        nonlocal writer, frames
+        transformed = pending.popleft().result()
+        if output_path:
+            if writer is None:
+                writer = open_writer(output_path, fps, transformed)
+            writer.write(transformed)
+        frames += 1
+        if frames % 100 == 0:
+            print(f"  {frames} frames, {frames / (time.perf_counter() - start):.1f} FPS")
+
+    with ProcessPoolExecutor(workers, initializer=_init_render_worker,
+                             initargs=(still_path, use_cache)) as pool:
+        for index, frame in enumerate(iter_frames(input_path, frame_count)):
+            job_frame = None if still_path else frame
+            pending.append(pool.submit(_render_frame, job_frame, state_for_frame(index)))
+            while pending and (len(pending) >= max_pending or pending[0].done()):
+                write_next()
+        while pending:
+            write_next()
+
+    total_seconds = time.perf_counter() - start
+    if writer is not None:
+        writer.release()
+        print(f"Output saved: {output_path}")
+
+    stats = {
+        "frames": frames,
+        "seconds": total_seconds,
+        "fps": frames / total_seconds if total_seconds > 0 else 0.0,
+        "workers": workers,
+    }
+    print(f"Rendered {frames} frames on {workers} processes in {total_seconds:.2f}s: "
+          f"{stats['fps']:.1f} FPS")
+    return stats
+
+
 def save_screenshot(combined, name):
     """Save a screenshot to the outputs folder."""
     output_path = os.path.join(SCRIPT_DIR, 'outputs', f'{name}.png')
@@ -94,18 +489,79 @@ def save_screenshot(combined, name):
     print(f"Screenshot saved: {output_path}")
 
 
-def main():
-    # Initialize webcam
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        print("ERROR: Could not open webcam.")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Real-time image warping.")
+    parser.add_argument("--source", default="0",
+                        help="live mode frames: webcam index, video file, image directory, "
+                             "recorded session or synthetic[:WxH[:N]] (default 0)")
+    parser.add_argument("--record", metavar="DIR",
+                        help="live mode: save every frame to DIR for exact replay with --source DIR")
+    parser.add_argument("--realtime", action="store_true",
+                        help="live mode: replay a recorded session at its recorded pace")
+    parser.add_argument("--headless", action="store_true",
+                        help="live mode: no window; run until the source ends or --max-frames")
+    parser.add_argument("--max-frames", type=int, help="live mode: stop after this many frames")
+    parser.add_argument("--timing", action="store_true",
+                        help="live mode: show p50/p95/p99 per stage and print them at exit")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="live mode: write per-frame stage times to PATH (.csv or .json)")
+    add_profile_args(parser)
+    parser.add_argument("--alloc", action="store_true",
+                        help="show bytes allocated per frame (uses tracemalloc)")
+    parser.add_argument("--input",
+                        help="batch mode: video file, image directory or glob to warp headlessly")
+    parser.add_argument("--output", help="batch mode: video file to write")
+    parser.add_argument("--transform", default="",
+                        help='fixed transform, e.g. "angle=15,scale=1.2,tx=10,flip_h" '
+                             "(the starting state in live mode)")
+    parser.add_argument("--keyframes",
+                        help="batch mode: JSON list of {\"frame\": n, field: value, ...} changes")
+    parser.add_argument("--fps", type=float,
+                        help="batch mode: output frame rate (default: the input's, or 30)")
+    parser.add_argument("--interpolate", action="store_true",
+                        help="batch mode: ease tx/ty/angle/scale/perspective between keyframes")
+    parser.add_argument("--frames", type=int,
+                        help="batch mode: number of frames to render (default: all input "
+                             "frames; for a still image, up to the last keyframe)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="batch mode: render on this many processes (default 1, in-process)")
+    args = parser.parse_args(argv)
+    profiler = profiler_from_args("image_warp", args)
+
+    if args.input:
+        frame_count = args.frames
+        if args.keyframes:
+            keyframes = load_keyframes(args.keyframes)
+            if frame_count is None and is_still_image(args.input) and keyframes:
+                frame_count = keyframes[-1]["frame"] + 1
+            if args.interpolate:
+                state_for_frame = lambda index: interpolated_state(keyframes, index)
+            else:
+                state_for_frame = lambda index: keyframe_state(keyframes, index)
+        else:
+            fixed_state = parse_transform_spec(args.transform)
+            state_for_frame = lambda index: fixed_state
+        # Interpolated states differ every frame, so cached remap tables would never be reused
+        use_cache = not (args.keyframes and args.interpolate)
+        if args.workers > 1:
+            render_parallel(args.input, args.output, state_for_frame, args.workers,
+                            args.fps, frame_count, use_cache)
+        else:
+            run_batch(args.input, args.output, state_for_frame, args.fps, frame_count,
+                      profiler, use_cache)
+        profiler.close()
         return
 
-    # Set resolution (optional, for better performance)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+    # Open the frame source; a webcam is read on a background thread (newest frame wins)
+    cap = frame_source.open_source(args.source, width=640, height=480,
+                                   realtime=args.realtime, record=args.record)
+    if not cap.isOpened():
+        print(f"ERROR: Could not open source {args.source}.")
+        cap.release()
+        return
 
-    state = TransformState()
+    state = parse_transform_spec(args.transform)
+    remap_cache = RemapCache()
     prev_time = time.time()
     fps = 0
 
@@ -122,11 +578,43 @@ def main():
     print("  q     - Quit")
     print("================================\n")
 
-    while True:
-        ret, frame = cap.read()
+    # The first frame sizes a side-by-side canvas. After that, frames are
+    # captured into its left half and warped straight into its right half,
+    # so the loop allocates no frame-sized buffers.
+    ret, frame = cap.read()
+    if not ret:
+        print("ERROR: Failed to read frame.")
+        cap.release()
+        return
+    h, w = frame.shape[:2]
+    combined = np.empty((h, 2 * w, 3), dtype=np.uint8)
+    original = combined[:, :w]
+    transformed = combined[:, w:]
+    np.copyto(original, frame)
+    have_frame = True  # the sizing frame is processed too, so replays see every frame
+    alloc_meter = AllocationMeter() if args.alloc else None
+    timer = make_timer(args.timing, args.trace)
+    frames = 0
+    start_time = time.perf_counter()
+
+    while args.max_frames is None or frames < args.max_frames:
+        timer.start_frame()
+        if alloc_meter is not None:
+            alloc_meter.start()
+
+        if have_frame:
+            ret, frame, have_frame = True, original, False
+        else:
+            ret, frame = cap.read(original)
         if not ret:
+            if args.headless:
+                break  # end of a file/synthetic source
             print("ERROR: Failed to read frame.")
             break
+        if frame is not original:
+            # The backend allocated its own buffer (e.g. size changed)
+            original[:] = frame
+        timer.mark("capture")
 
         # Calculate FPS
         current_time = time.time()
@@ -134,10 +622,8 @@ def main():
         prev_time = current_time
 
         # Apply transformations
-        transformed = apply_transforms(frame, state)
-
-        # Create side-by-side display
-        combined = np.hstack((frame, transformed))
+        apply_transforms(original, state, remap_cache, dst=transformed)
+        timer.mark("warp")
 
         # Add text overlays
         mode_text = get_mode_text(state)
@@ -145,16 +631,32 @@ def main():
                     cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
         cv2.putText(combined, f"FPS: {fps:.1f}", (10, 55),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        cv2.putText(combined, cap.stats_text(), (10, 85),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
         cv2.putText(combined, "Original", (10, combined.shape[0] - 10),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-        cv2.putText(combined, "Transformed", (frame.shape[1] + 10, combined.shape[0] - 10),
+        cv2.putText(combined, "Transformed", (w + 10, combined.shape[0] - 10),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+        if alloc_meter is not None:
+            alloc_meter.stop()
+            cv2.putText(combined, f"Alloc/frame: {alloc_meter.bytes / 1024:.1f} KB", (10, 115),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        timer.draw(combined, w + 10, 25)
+        timer.mark("draw")
+
+        frames += 1
+        profiler.frame()
+        if args.headless:
+            timer.end_frame()
+            continue
 
         # Display
         cv2.imshow("Image Warp - Press 'q' to quit", combined)
 
         # Handle keyboard input
         key = cv2.waitKey(1) & 0xFF
+        timer.mark("display")
+        timer.end_frame()
 
         if key == ord('q'):
             break
@@ -200,7 +702,13 @@ def main():
             print(f"Translation: ({state.tx}, {state.ty})")
 
     cap.release()
-    cv2.destroyAllWindows()
+    timer.close()
+    profiler.close()
+    elapsed = time.perf_counter() - start_time
+    if frames and elapsed > 0:
+        print(f"{frames} frames in {elapsed:.2f}s: {frames / elapsed:.1f} FPS")
+    if not args.headless:
+        cv2.destroyAllWindows()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,385 @@
+"""
+Mini Project 3: Reference Gallery - Recognising One of Many Targets
+Course: CS5330 - Pattern Recognition and Computer Vision
+
+Recognises which of a directory of reference images is in view, using a
+vocabulary tree over SIFT descriptors (Nister & Stewenius, 2006):
+
+1. Offline, SIFT features are extracted from every reference image and a
+   tree of k-means clusters (branch x depth) is trained on them. Each
+   leaf is a visual word. Every image becomes a TF-IDF weighted
+   bag-of-words vector, stored as inverted files (word -> images with
+   that word).
+2. At runtime the query's descriptors are pushed down the tree (depth x
+   branch distance checks each, not one per word). Only the inverted
+   files of the words present are scored, which gives a shortlist.
+3. Only the top few shortlisted images are matched descriptor by
+   descriptor and verified with a RANSAC homography.
+
+Scoring touches only the posting lists of the query's words, and
+verification runs on a fixed number of candidates, so query time grows
+much more slowly than the gallery.
+
+    python gallery.py build references/ -o gallery.npz
+    python gallery.py query gallery.npz photo.jpg
+    python sewing_machine.py --gallery gallery.npz
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(SCRIPT_DIR))
+
+from common.frame_source import IMAGE_EXTENSIONS
+
+MAX_SIDE = 640          # reference images are shrunk to fit this before detection
+MAX_FEATURES = 500      # strongest SIFT keypoints kept per reference image
+TRAIN_SAMPLE = 200000   # descriptors used to train the vocabulary tree
+
+
+def extract_features(sift, image, max_side=MAX_SIDE):
+    """SIFT keypoint positions and uint8 descriptors of image, shrunk to max_side.
+
+    Returns (pts, descriptors, (w, h)) with pts in the shrunk image's
+    coordinates. SIFT descriptor values are whole numbers in 0-255, so
+    uint8 stores them exactly at a quarter of the size.
+    """
+    h, w = image.shape[:2]
+    scale = min(1.0, max_side / max(h, w))
+    if scale < 1.0:
+        image = cv2.resize(image, (round(w * scale), round(h * scale)),
+                           interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    kps, des = sift.detectAndCompute(gray, None)
+    if des is None:
+        return np.zeros((0, 2), np.float32), np.zeros((0, 128), np.uint8), gray.shape[::-1]
+    pts = np.float32([kp.pt for kp in kps]).reshape(-1, 2)
+    return pts, np.clip(des, 0, 255).astype(np.uint8), gray.shape[::-1]
+
+
+class VocabularyTree:
+    """Hierarchical k-means over descriptors; the leaves are visual words.
+
+    Stored flat: centers[node], children[node] (-1 where there is none)
+    and words[node] (the word id of a leaf, -1 for inner nodes). Node 0 is
+    the root.
+    """
+
+    def __init__(self, centers, children, words):
+        self.centers = centers
+        self.children = children
+        self.words = words
+        self.num_words = int(words.max()) + 1
+        self._center_norms = (centers.astype(np.float32) ** 2).sum(axis=1)
+
+    @classmethod
+    def train(cls, descriptors, branch=10, depth=3, seed=0):
+        """Cluster descriptors into at most branch ** depth words."""
+        cv2.setRNGSeed(seed)
+        data = descriptors.astype(np.float32)
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
+        centers = [data.mean(axis=0)]
+        children = [[-1] * branch]
+        words = [-1]
+        num_words = 0
+        pending = [(0, data, 0)]  # (node, its descriptors, level)
+        while pending:
+            node, points, level = pending.pop()
+            if level == depth or len(points) < 2 * branch:
+                words[node] = num_words
+                num_words += 1
+                continue
+            _, labels, cluster_centers = cv2.kmeans(points, branch, None, criteria, 1,
+                                                    cv2.KMEANS_PP_CENTERS)
+            labels = labels.ravel()
+            for k in range(branch):
+                child = len(centers)
+                centers.append(cluster_centers[k])
+                children.append([-1] * branch)
+                words.append(-1)
+                children[node][k] = child
+                pending.append((child, points[labels == k], level + 1))
+        return cls(np.float32(centers), np.int32(children), np.int32(words))
+
+    def quantize(self, descriptors):
+        """Visual word of each descriptor, found by walking down the tree."""
+        data = descriptors.astype(np.float32)
+        node = np.zeros(len(data), np.int32)
+        while True:
+            inner = self.children[node, 0] >= 0
+            if not inner.any():
+                break
+            for parent in np.unique(node[inner]):
+                rows = np.flatnonzero(node == parent)
+                kids = self.children[parent]
+                kids = kids[kids >= 0]
+                # Nearest child center; |x|^2 is the same for every child, so it is left out
+                dist = self._center_norms[kids] - 2 * data[rows] @ self.centers[kids].T
+                node[rows] = kids[dist.argmin(axis=1)]
+        return self.words[node]
+
+
+class Gallery:
+    """Reference images indexed for recognition: vocabulary tree, inverted
+    files with TF-IDF weights, and the features needed for verification."""
+
+    def __init__(self, tree, idf, word_ptr, post_image, post_weight, names, paths,
+                 sizes, feature_ptr, pts, descriptors):
+        self.tree = tree
+        self.idf = idf
+        self.word_ptr = word_ptr        # postings of word w: word_ptr[w]:word_ptr[w + 1]
+        self.post_image = post_image
+        self.post_weight = post_weight
+        self.names = names
+        self.paths = paths
+        self.sizes = sizes              # (w, h) the features were extracted at
+        self.feature_ptr = feature_ptr  # features of image i: feature_ptr[i]:feature_ptr[i + 1]
+        self.pts = pts
+        self.descriptors = descriptors
+        self.matcher = cv2.BFMatcher(cv2.NORM_L2)
+        self.shortlist_ms = 0.0
+        self.verify_ms = 0.0
+        self._images = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    # --- Building ---
+
+    @classmethod
+    def build(cls, directory, branch=10, depth=3, max_features=MAX_FEATURES, seed=0):
+        """Extract features from every image in directory and index them."""
+        files = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                       if name.lower().endswith(IMAGE_EXTENSIONS))
+        sift = cv2.SIFT_create(nfeatures=max_features)
+        names, paths, sizes, all_pts, all_des = [], [], [], [], []
+        start = time.perf_counter()
+        for i, path in enumerate(files):
+            image = cv2.imread(path)
+            if image is None:
+                print(f"  skipping unreadable {path}")
+                continue
+            pts, des, size = extract_features(sift, image)
+            if len(des) < 4:
+                print(f"  skipping {path}: only {len(des)} keypoints")
+                continue
+            names.append(os.path.splitext(os.path.basename(path))[0])
+            paths.append(os.path.abspath(path))
+            sizes.append(size)
+            all_pts.append(pts)
+            all_des.append(des)
+            if (i + 1) % 50 == 0:
+                print(f"  features: {i + 1}/{len(files)} images")
+        if not names:
+            raise ValueError(f"No usable images in {directory}")
+        print(f"Extracted features from {len(names)} images in {time.perf_counter() - start:.1f}s")
+
+        descriptors = np.concatenate(all_des)
+        start = time.perf_counter()
+        rng = np.random.default_rng(seed)
+        sample = descriptors
+        if len(sample) > TRAIN_SAMPLE:
+            sample = descriptors[rng.choice(len(descriptors), TRAIN_SAMPLE, replace=False)]
+        tree = VocabularyTree.train(sample, branch=branch, depth=depth, seed=seed)
+        print(f"Trained a {branch}x{depth} vocabulary tree ({tree.num_words} words) on "
+              f"{len(sample)} descriptors in {time.perf_counter() - start:.1f}s")
+
+        feature_ptr = np.zeros(len(names) + 1, np.int64)
+        feature_ptr[1:] = np.cumsum([len(d) for d in all_des])
+        image_words = [tree.quantize(d) for d in all_des]
+        idf, word_ptr, post_image, post_weight = cls._inverted_files(image_words, tree.num_words)
+        return cls(tree, idf, word_ptr, post_image, post_weight, np.array(names),
+                   np.array(paths), np.int32(sizes), feature_ptr,
+                   np.concatenate(all_pts), descriptors)
+
+    @staticmethod
+    def _inverted_files(image_words, num_words):
+        """IDF per word, and postings sorted by word with L2-normalised TF-IDF weights."""
+        df = np.zeros(num_words, np.int64)
+        for words in image_words:
+            df[np.unique(words)] += 1
+        # Words in no image get 0 weight, like words in every image
+        idf = np.where(df > 0, np.log(len(image_words) / np.maximum(df, 1)), 0.0).astype(np.float32)
+
+        words_all, images_all, weights_all = [], [], []
+        for image, words in enumerate(image_words):
+            unique, counts = np.unique(words, return_counts=True)
+            weights = counts / len(words) * idf[unique]
+            norm = np.linalg.norm(weights)
+            if norm > 0:
+                weights /= norm
+            words_all.append(unique)
+            images_all.append(np.full(len(unique), image, np.int32))
+            weights_all.append(weights)
+        words_all = np.concatenate(words_all)
+        order = np.argsort(words_all, kind="stable")
+        word_ptr = np.zeros(num_words + 1, np.int64)
+        word_ptr[1:] = np.cumsum(np.bincount(words_all, minlength=num_words))
+        return (idf, word_ptr, np.concatenate(images_all)[order],
+                np.concatenate(weights_all)[order].astype(np.float32))
+
+    # --- Saving and loading ---
+
+    def save(self, path):
+        root = os.path.dirname(os.path.abspath(path))
+        np.savez_compressed(
+            path, centers=self.tree.centers, children=self.tree.children, words=self.tree.words,
+            idf=self.idf, word_ptr=self.word_ptr, post_image=self.post_image,
+            post_weight=self.post_weight, names=self.names,
+            paths=np.array([os.path.relpath(p, root) for p in self.paths]),
+            sizes=self.sizes, feature_ptr=self.feature_ptr, pts=self.pts,
+            descriptors=self.descriptors)
+
+    @classmethod
+    def load(cls, path):
+        root = os.path.dirname(os.path.abspath(path))
+        with np.load(path) as data:
+            tree = VocabularyTree(data["centers"], data["children"], data["words"])
+            return cls(tree, data["idf"], data["word_ptr"], data["post_image"],
+                       data["post_weight"], data["names"],
+                       [os.path.join(root, p) for p in data["paths"]], data["sizes"],
+                       data["feature_ptr"], data["pts"], data["descriptors"])
+
+    # --- Querying ---
+
+    def features(self, image):
+        """(pts, descriptors) of reference image index image."""
+        a, b = self.feature_ptr[image], self.feature_ptr[image + 1]
+        return self.pts[a:b], self.descriptors[a:b]
+
+    def image(self, image):
+        """The reference image, resized to the size its features were taken at."""
+        if image not in self._images:
+            img = cv2.imread(self.paths[image])
+            if img is None:
+                img = np.zeros((self.sizes[image][1], self.sizes[image][0], 3), np.uint8)
+            self._images[image] = cv2.resize(img, tuple(int(v) for v in self.sizes[image]))
+        return self._images[image]
+
+    def shortlist(self, descriptors, top=10):
+        """[(image, score)] of the top images by TF-IDF cosine similarity."""
+        words = self.tree.quantize(descriptors)
+        unique, counts = np.unique(words, return_counts=True)
+        weights = counts / len(words) * self.idf[unique]
+        norm = np.linalg.norm(weights)
+        if norm == 0:
+            return []
+        weights /= norm
+        scores = np.zeros(len(self), np.float32)
+        for word, weight in zip(unique, weights):
+            if weight == 0:
+                continue
+            a, b = self.word_ptr[word], self.word_ptr[word + 1]
+            scores[self.post_image[a:b]] += weight * self.post_weight[a:b]
+        best = np.argsort(-scores)[:top]
+        return [(int(i), float(scores[i])) for i in best if scores[i] > 0]
+
+    def verify(self, image, pts, descriptors, ratio=0.75, min_inliers=12):
+        """Ratio-test matches to reference image and a RANSAC homography.
+
+        Returns (inlier matches, homography from reference to query), or
+        None if there are fewer than min_inliers inliers.
+        """
+        ref_pts, ref_des = self.features(image)
+        if len(ref_des) < 2 or len(descriptors) < 2:
+            return None
+        good = []
+        for pair in self.matcher.knnMatch(descriptors.astype(np.float32),
+                                          ref_des.astype(np.float32), k=2):
+            if len(pair) == 2 and pair[0].distance < ratio * pair[1].distance:
+                good.append(pair[0])
+        if len(good) < max(4, min_inliers):
+            return None
+        src = np.float32([ref_pts[m.trainIdx] for m in good]).reshape(-1, 1, 2)
+        dst = np.float32([pts[m.queryIdx] for m in good]).reshape(-1, 1, 2)
+        H, mask = cv2.findHomography(src, dst, cv2.RANSAC, 5.0)
+        if H is None:
+            return None
+        inliers = [m for m, ok in zip(good, mask.ravel()) if ok]
+        if len(inliers) < min_inliers:
+            return None
+        return inliers, H
+
+    def recognize(self, pts, descriptors, shortlist=10, verify=3, ratio=0.75, min_inliers=12):
+        """Which reference image the query shows, or None.
+
+        pts are the query keypoint positions and descriptors their SIFT
+        descriptors. The top `verify` of the `shortlist` best-scoring images
+        are verified; the one with most inliers wins. Returns a dict with
+        image, name, score, inliers (matches) and homography. Timings of
+        the last call are left in shortlist_ms and verify_ms.
+        """
+        start = time.perf_counter()
+        candidates = self.shortlist(descriptors, shortlist) if descriptors is not None else []
+        mid = time.perf_counter()
+        best = None
+        for image, score in candidates[:verify]:
+            verified = self.verify(image, pts, descriptors, ratio, min_inliers)
+            if verified and (best is None or len(verified[0]) > len(best["inliers"])):
+                best = {"image": image, "name": str(self.names[image]), "score": score,
+                        "inliers": verified[0], "homography": verified[1]}
+        self.shortlist_ms = (mid - start) * 1000
+        self.verify_ms = (time.perf_counter() - mid) * 1000
+        return best
+
+
+def build_main(args):
+    gallery = Gallery.build(args.directory, branch=args.branch, depth=args.depth,
+                            max_features=args.features)
+    gallery.save(args.output)
+    print(f"Saved gallery of {len(gallery)} images "
+          f"({os.path.getsize(args.output) / 1e6:.1f} MB) to {args.output}")
+
+
+def query_main(args):
+    start = time.perf_counter()
+    gallery = Gallery.load(args.gallery)
+    print(f"Loaded {len(gallery)} images in {(time.perf_counter() - start) * 1000:.0f} ms")
+    sift = cv2.SIFT_create()
+    for path in args.images:
+        image = cv2.imread(path)
+        if image is None:
+            print(f"{path}: could not read")
+            continue
+        pts, des, _ = extract_features(sift, image, max_side=max(image.shape[:2]))
+        result = gallery.recognize(pts, des, shortlist=args.shortlist, verify=args.verify)
+        timing = f"shortlist {gallery.shortlist_ms:.1f} ms, verify {gallery.verify_ms:.1f} ms"
+        if result is None:
+            print(f"{path}: no match ({timing})")
+        else:
+            print(f"{path}: {result['name']} with {len(result['inliers'])} inliers, "
+                  f"score {result['score']:.3f} ({timing})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query a reference image gallery.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="index a directory of reference images")
+    build.add_argument("directory")
+    build.add_argument("-o", "--output", default="gallery.npz")
+    build.add_argument("--branch", type=int, default=10, help="children per tree node")
+    build.add_argument("--depth", type=int, default=3,
+                       help="tree levels (branch ** depth words at most)")
+    build.add_argument("--features", type=int, default=MAX_FEATURES,
+                       help="SIFT keypoints kept per image")
+    query = commands.add_parser("query", help="recognise images against a gallery")
+    query.add_argument("gallery")
+    query.add_argument("images", nargs="+")
+    query.add_argument("--shortlist", type=int, default=10)
+    query.add_argument("--verify", type=int, default=3,
+                       help="shortlisted images checked with RANSAC")
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        build_main(args)
+    else:
+        query_main(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,8 @@ Demonstrates SIFT feature detection with FLANN-based matching between
 two video sources (2-camera) or a webcam and a static image (1-camera simulation).
 """
 
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 import time
@@ -13,26 +15,541 @@ import os
 import sys
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(SCRIPT_DIR))
 
+from common.feature_cache import cached_features
+from common.frame_source import open_source
+from common.profiling import add_profile_args, profiler_from_args
+from common.shm_pipeline import SharedFramePipeline
+from common.stage_timer import make_timer
 
-def main():
-    # Allow camera index override: python sewing_machine.py [cam_index]
-    cam_index = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+
+def extract_features(sift, frame):
+    """Grayscale conversion and SIFT detection for one side of a frame pair."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    kp, des = sift.detectAndCompute(gray, None)
+    return gray, kp, des
+
+
+def create_flann():
+    """FLANN matcher with a KD-Tree index, suited to SIFT descriptors."""
+    FLANN_INDEX_KDTREE = 1
+    index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
+    search_params = dict(checks=50)
+    return cv2.FlannBasedMatcher(index_params, search_params)
+
+
+class ReferenceMatcher:
+    """FLANN matcher that builds its index over the reference descriptors once.
+
+    flann.knnMatch(des_l, des_r) builds a KD-tree over des_r on every
+    call. Here the index is trained by set_reference() and reused by
+    every knn_match() until the reference changes. With a static image
+    that is once per run; with two cameras it is once per frame, the
+    same work as before. Build and query times are kept separately.
+    """
+
+    def __init__(self):
+        self.flann = create_flann()
+        self.reference = None
+        self.builds = 0
+        self.queries = 0
+        self.build_seconds = 0.0
+        self.query_seconds = 0.0
+
+    def set_reference(self, descriptors):
+        """Train the index on descriptors unless it already holds them."""
+        if descriptors is self.reference:
+            return
+        self.reference = descriptors
+        self.flann.clear()
+        if descriptors is None or len(descriptors) < 2:
+            return
+        start = time.perf_counter()
+        self.flann.add([descriptors])
+        self.flann.train()
+        self.build_seconds += time.perf_counter() - start
+        self.builds += 1
+
+    def knn_match(self, descriptors, k=2):
+        """knn matches of descriptors against the trained reference."""
+        if descriptors is None or len(descriptors) < 2 or self.builds == 0 \
+                or self.reference is None or len(self.reference) < 2:
+            return []
+        start = time.perf_counter()
+        matches = self.flann.knnMatch(descriptors, k=k)
+        self.query_seconds += time.perf_counter() - start
+        self.queries += 1
+        return matches
+
+    def stats_text(self):
+        build_ms = self.build_seconds * 1000 / max(1, self.builds)
+        query_ms = self.query_seconds * 1000 / max(1, self.queries)
+        return f"Index: {self.builds} builds {build_ms:.1f} ms | query {query_ms:.1f} ms"
+
+    def report(self):
+        total = self.build_seconds + self.query_seconds
+        if not total:
+            return
+        print(f"\nFLANN index: {self.builds} builds, {self.build_seconds * 1000:.0f} ms "
+              f"({self.build_seconds / total:.0%}); {self.queries} queries, "
+              f"{self.query_seconds * 1000:.0f} ms ({self.query_seconds / total:.0%})")
+
+
+def knn_pairs(matcher, des_l, des_r):
+    """knn (k=2) matches of des_l against des_r, with either kind of matcher."""
+    if isinstance(matcher, ReferenceMatcher):
+        matcher.set_reference(des_r)
+        return matcher.knn_match(des_l, k=2)
+    if des_l is not None and des_r is not None and len(des_l) >= 2 and len(des_r) >= 2:
+        return matcher.knnMatch(des_l, des_r, k=2)
+    return []
+
+
+class MatchTracker:
+    """Carries SIFT matches between detections with pyramidal Lucas-Kanade flow.
+
+    After a full detect-and-match, reset() keeps the matched point pairs.
+    On the frames in between, track() moves the left points (and the right
+    ones, unless the right side is a static image) with optical flow. A
+    pair is dropped when either point is lost or fails a forward-backward
+    check. needs_redetect() applies the redetection policy:
+
+        interval   every `interval` frames
+        quality    when fewer than min_fraction of the detected matches
+                   (or fewer than min_matches) are still tracked
+        both       whichever comes first (default)
+    """
+
+    POLICIES = ("interval", "quality", "both")
+    LK_PARAMS = dict(winSize=(15, 15), maxLevel=2,
+                     criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+
+    def __init__(self, interval=10, policy="both", min_fraction=0.5, min_matches=8,
+                 max_fb_error=1.0):
+        self.interval = interval
+        self.policy = policy
+        self.min_fraction = min_fraction
+        self.min_matches = min_matches
+        self.max_fb_error = max_fb_error
+        self.pts_l = self.pts_r = None
+        self.prev_l = self.prev_r = None
+        self.detected = 0       # matches at the last detection
+        self.since_detect = 0   # frames tracked since then
+        self.redetections = {"start": 0, "interval": 0, "quality": 0}
+        self.reason = "start"
+
+    def needs_redetect(self):
+        """Whether this frame should run SIFT; sets self.reason if so."""
+        if self.pts_l is None:
+            self.reason = "start"
+            return True
+        # since_detect counts tracked frames, so this detects every interval frames
+        if self.policy != "quality" and self.since_detect >= self.interval - 1:
+            self.reason = "interval"
+            return True
+        if self.policy != "interval" and \
+                len(self.pts_l) < max(self.min_matches, self.min_fraction * self.detected):
+            self.reason = "quality"
+            return True
+        return False
+
+    def reset(self, gray_l, gray_r, pts_l, pts_r):
+        """Start tracking freshly matched pairs. gray_r is None for a static right side."""
+        self.redetections[self.reason] += 1
+        self.prev_l, self.prev_r = gray_l, gray_r
+        self.pts_l = np.float32(pts_l).reshape(-1, 1, 2)
+        self.pts_r = np.float32(pts_r).reshape(-1, 1, 2)
+        self.detected = len(self.pts_l)
+        self.since_detect = 0
+
+    def _flow(self, prev, cur, pts):
+        """New positions of pts from prev to cur, and which ones tracked reliably."""
+        new, status, _ = cv2.calcOpticalFlowPyrLK(prev, cur, pts, None, **self.LK_PARAMS)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(cur, prev, new, None, **self.LK_PARAMS)
+        fb_error = np.linalg.norm((pts - back).reshape(-1, 2), axis=1)
+        ok = (status.ravel() == 1) & (back_status.ravel() == 1) & (fb_error < self.max_fb_error)
+        return new, ok
+
+    def track(self, gray_l, gray_r=None):
+        """Move the tracked pairs to the current frames; returns how many survive."""
+        self.since_detect += 1
+        if len(self.pts_l):
+            new_l, ok = self._flow(self.prev_l, gray_l, self.pts_l)
+            new_r = self.pts_r
+            if gray_r is not None:
+                new_r, ok_r = self._flow(self.prev_r, gray_r, self.pts_r)
+                ok &= ok_r
+            self.pts_l, self.pts_r = new_l[ok], new_r[ok]
+        self.prev_l, self.prev_r = gray_l, gray_r
+        return len(self.pts_l)
+
+    def keypoints_and_matches(self):
+        """Tracked pairs as keypoints and one-to-one matches for drawMatches."""
+        kp_l = to_keypoints(self.pts_l.reshape(-1, 2))
+        kp_r = to_keypoints(self.pts_r.reshape(-1, 2))
+        return kp_l, kp_r, [cv2.DMatch(i, i, 0) for i in range(len(kp_l))]
+
+    def stats_text(self):
+        counts = self.redetections
+        return (f"Redetect: {self.since_detect}/{self.interval} ({self.policy}) | "
+                f"interval {counts['interval']} quality {counts['quality']}")
+
+
+def handle_key(key, match_img, ratio_threshold):
+    """Apply a keypress. Returns the new ratio threshold, or None to quit."""
+    if key == ord('q'):
+        return None
+    elif key == ord('s'):
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        out_path = os.path.join(SCRIPT_DIR, 'outputs', f'screenshot_{timestamp}.png')
+        cv2.imwrite(out_path, match_img)
+        print(f"Screenshot saved: {out_path}")
+    elif key == ord('+') or key == ord('='):
+        ratio_threshold = min(0.95, ratio_threshold + 0.05)
+        print(f"Ratio threshold: {ratio_threshold:.2f}")
+    elif key == ord('-') or key == ord('_'):
+        ratio_threshold = max(0.1, ratio_threshold - 0.05)
+        print(f"Ratio threshold: {ratio_threshold:.2f}")
+    return ratio_threshold
+
+
+# --- Pipeline mode: detection and matching run in worker processes ---
+
+def pipeline_setup(static_path, matcher="trained"):
+    """Per-worker state: detector, matcher and (1-camera mode) the static image."""
+    return {
+        "sift": cv2.SIFT_create(),
+        "flann": ReferenceMatcher() if matcher == "trained" else create_flann(),
+        "static": cv2.imread(static_path) if static_path else None,
+        "static_path": static_path,
+        "static_features": None,
+    }
+
+
+def pipeline_match(state, frames, context=None):
+    """Detect and knn-match one shared-memory slot in a worker.
+
+    Returns plain arrays, since KeyPoint and DMatch objects don't pickle:
+    keypoint positions for each side and one (queryIdx, trainIdx,
+    best distance, second distance) row per knn pair, so the ratio test
+    can run in the render process and follow the live threshold.
+    """
+    sift = state["sift"]
+    gray_l = cv2.cvtColor(frames[0], cv2.COLOR_BGR2GRAY)
+    kp_l, des_l = sift.detectAndCompute(gray_l, None)
+    if len(frames) > 1:
+        gray_r = cv2.cvtColor(frames[1], cv2.COLOR_BGR2GRAY)
+        kp_r, des_r = sift.detectAndCompute(gray_r, None)
+    else:
+        # The static image is the same every frame, so each worker loads its features once
+        if state["static_features"] is None:
+            h, w = frames.shape[1:3]
+            state["static_features"], _ = cached_features(
+                state["static_path"], (w, h), sift, image=state["static"])
+        kp_r, des_r = state["static_features"]
+
+    pairs = []
+    for pair in knn_pairs(state["flann"], des_l, des_r):
+        if len(pair) == 2:
+            m, n = pair
+            pairs.append((m.queryIdx, m.trainIdx, m.distance, n.distance))
+    return {
+        "pts_l": np.float32([kp.pt for kp in kp_l]).reshape(-1, 2),
+        "pts_r": np.float32([kp.pt for kp in kp_r]).reshape(-1, 2),
+        "pairs": np.float32(pairs).reshape(-1, 4),
+    }
+
+
+def to_keypoints(pts):
+    return [cv2.KeyPoint(float(x), float(y), 1) for x, y in pts]
+
+
+def run_pipeline(args, left_spec, right_spec, static_img, static_path, profiler):
+    """Capture, SIFT workers and rendering in separate processes (--pipeline N)."""
+    sources = [left_spec] + ([right_spec] if right_spec is not None else [])
+    pipeline = SharedFramePipeline(sources, pipeline_match, pipeline_setup,
+                                   (None if right_spec is not None else static_path, args.matcher),
+                                   workers=args.pipeline, realtime=args.realtime,
+                                   record=args.record)
+    try:
+        pipeline.start()
+    except IOError as e:
+        print(f"ERROR: {e}")
+        return
+    simulation_mode = right_spec is None
+    static_resized = None
+    ratio_threshold = 0.7
+    timer = make_timer(args.timing, args.trace)
+    prev_time = time.time()
+    frame_count = 0
+    start_time = time.perf_counter()
+
+    timer.start_frame()
+    for seq, frames, result in pipeline:
+        timer.mark("wait")
+        frame_l = frames[0]
+        if simulation_mode:
+            if static_resized is None:
+                h, w = frame_l.shape[:2]
+                static_resized = cv2.resize(static_img, (w, h))
+            frame_r = static_resized
+        else:
+            frame_r = frames[1]
+
+        # Lowe's Ratio Test on the pairs the worker found
+        pairs = result["pairs"]
+        good = pairs[pairs[:, 2] < ratio_threshold * pairs[:, 3]]
+        good_matches = [cv2.DMatch(int(q), int(t), float(d)) for q, t, d, _ in good]
+        match_img = cv2.drawMatches(
+            frame_l, to_keypoints(result["pts_l"]), frame_r, to_keypoints(result["pts_r"]),
+            good_matches, None,
+            matchColor=(0, 255, 0),
+            singlePointColor=(255, 0, 0),
+            flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS
+        )
+
+        current_time = time.time()
+        dt = current_time - prev_time
+        fps = 1 / dt if dt > 0 else 0
+        prev_time = current_time
+
+        mode_label = "1-CAM SIMULATION" if simulation_mode else "2-CAM LIVE"
+        cv2.putText(match_img, f"Mode: {mode_label} | PIPELINE x{pipeline.workers}", (10, 25),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        cv2.putText(match_img, f"Matches: {len(good_matches)} | Ratio: {ratio_threshold:.2f}",
+                    (10, 55), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        cv2.putText(match_img, f"FPS: {fps:.1f}", (10, 85),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        cv2.putText(match_img, f"Keypoints: L={len(result['pts_l'])} R={len(result['pts_r'])}",
+                    (10, 115), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        cv2.putText(match_img, f"Frame {seq} | dropped {pipeline.dropped}", (10, 145),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        timer.draw(match_img, 10, 175)
+        timer.mark("draw")
+        frame_count += 1
+        profiler.frame()
+
+        key = None
+        if not args.headless:
+            cv2.imshow("Sewing Machine - Press 'q' to quit", match_img)
+            key = cv2.waitKey(1) & 0xFF
+            timer.mark("display")
+        timer.end_frame()
+        if key is not None:
+            ratio_threshold = handle_key(key, match_img, ratio_threshold)
+            if ratio_threshold is None:
+                break
+        if args.max_frames is not None and frame_count >= args.max_frames:
+            break
+        timer.start_frame()
+
+    timer.close()
+    elapsed = time.perf_counter() - start_time
+    if frame_count and elapsed > 0:
+        print(f"{frame_count} frames in {elapsed:.2f}s: {frame_count / elapsed:.1f} FPS "
+              f"({pipeline.workers} workers)")
+    if not args.headless:
+        cv2.destroyAllWindows()
+
+
+# --- Gallery mode: recognise which of many reference images is in view ---
+
+def gallery_view(gallery, recognition, size):
+    """Right-hand panel for a recognition: the reference image, its keypoints
+    scaled to size=(w, h), and the inlier matches (or a blank panel)."""
+    w, h = size
+    if recognition is None:
+        panel = np.zeros((h, w, 3), np.uint8)
+        cv2.putText(panel, "No match", (w // 2 - 60, h // 2), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.8, (0, 0, 255), 2)
+        return panel, [], []
+    image = recognition["image"]
+    ref_w, ref_h = gallery.sizes[image]
+    panel = cv2.resize(gallery.image(image), size)
+    ref_pts, _ = gallery.features(image)
+    scale = np.float32([w / ref_w, h / ref_h])
+    return panel, to_keypoints(ref_pts * scale), recognition["inliers"]
+
+
+def run_gallery(args, cap_l, profiler):
+    """Recognise gallery images in the left frames (--gallery PATH)."""
+    from gallery import Gallery
+
+    start = time.perf_counter()
+    gallery = Gallery.load(args.gallery)
+    print(f"Loaded gallery of {len(gallery)} images in "
+          f"{(time.perf_counter() - start) * 1000:.0f} ms")
+    sift = cv2.SIFT_create()
+    timer = make_timer(args.timing, args.trace)
+    prev_time = time.time()
+    ratio_threshold = 0.75
+    frame_count = 0
+    recognized = 0
+    start_time = time.perf_counter()
+
+    while args.max_frames is None or frame_count < args.max_frames:
+        timer.start_frame()
+        ret, frame_l = cap_l.read()
+        if not ret:
+            break
+        timer.mark("capture")
+        gray_l = cv2.cvtColor(frame_l, cv2.COLOR_BGR2GRAY)
+        timer.mark("convert")
+        kp_l, des_l = sift.detectAndCompute(gray_l, None)
+        timer.mark("detect")
+        pts_l = np.float32([kp.pt for kp in kp_l]).reshape(-1, 2)
+        recognition = gallery.recognize(pts_l, des_l, shortlist=args.shortlist,
+                                        verify=args.verify, ratio=ratio_threshold)
+        timer.mark("recognize")
+
+        h, w = frame_l.shape[:2]
+        frame_r, kp_r, matches = gallery_view(gallery, recognition, (w, h))
+        frame_l = frame_l.copy()
+        if recognition is not None:
+            recognized += 1
+            # Outline of the reference image as it appears in the frame
+            ref_w, ref_h = gallery.sizes[recognition["image"]]
+            corners = np.float32([[0, 0], [ref_w, 0], [ref_w, ref_h], [0, ref_h]])
+            outline = cv2.perspectiveTransform(corners.reshape(-1, 1, 2),
+                                               recognition["homography"])
+            cv2.polylines(frame_l, [np.int32(outline)], True, (0, 255, 255), 2)
+        match_img = cv2.drawMatches(
+            frame_l, kp_l, frame_r, kp_r, matches, None,
+            matchColor=(0, 255, 0),
+            singlePointColor=(255, 0, 0),
+            flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS
+        )
+
+        current_time = time.time()
+        dt = current_time - prev_time
+        fps = 1 / dt if dt > 0 else 0
+        prev_time = current_time
+
+        label = (f"{recognition['name']} ({len(recognition['inliers'])} inliers)"
+                 if recognition is not None else "none")
+        cv2.putText(match_img, f"Mode: GALLERY ({len(gallery)} images) | Match: {label}",
+                    (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        cv2.putText(match_img, f"Shortlist {gallery.shortlist_ms:.1f} ms | "
+                               f"Verify {gallery.verify_ms:.1f} ms",
+                    (10, 55), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        cv2.putText(match_img, f"FPS: {fps:.1f}", (10, 85),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        cv2.putText(match_img, f"Keypoints: {len(kp_l)} | Ratio: {ratio_threshold:.2f}",
+                    (10, 115), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        cv2.putText(match_img, cap_l.stats_text(), (10, 145),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        timer.draw(match_img, 10, 175)
+        timer.mark("draw")
+        frame_count += 1
+        profiler.frame()
+
+        if args.headless:
+            timer.end_frame()
+            continue
+        cv2.imshow("Sewing Machine - Press 'q' to quit", match_img)
+        key = cv2.waitKey(1) & 0xFF
+        timer.mark("display")
+        timer.end_frame()
+        ratio_threshold = handle_key(key, match_img, ratio_threshold)
+        if ratio_threshold is None:
+            break
+
+    cap_l.release()
+    timer.close()
+    elapsed = time.perf_counter() - start_time
+    if frame_count and elapsed > 0:
+        print(f"{frame_count} frames in {elapsed:.2f}s: {frame_count / elapsed:.1f} FPS, "
+              f"recognized in {recognized}")
+    if not args.headless:
+        cv2.destroyAllWindows()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Real-time SIFT feature matching.")
+    parser.add_argument("cam_index", nargs="?", default="0",
+                        help="left camera index (default 0)")
+    parser.add_argument("--source",
+                        help="left frames instead of a camera: video file, image directory, "
+                             "recorded session or synthetic[:WxH[:N]]")
+    parser.add_argument("--right-source",
+                        help="right frames (default: camera 1 when the left is a camera, "
+                             "otherwise the static image)")
+    parser.add_argument("--record", metavar="DIR",
+                        help="save every left frame to DIR for exact replay with --source DIR")
+    parser.add_argument("--realtime", action="store_true",
+                        help="replay a recorded session at its recorded pace")
+    parser.add_argument("--headless", action="store_true",
+                        help="no window; run until the source ends or --max-frames")
+    parser.add_argument("--max-frames", type=int, help="stop after this many frames")
+    parser.add_argument("--timing", action="store_true",
+                        help="show p50/p95/p99 per stage and print them at exit")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="write per-frame stage times to PATH (.csv or .json)")
+    parser.add_argument("--matcher", choices=("trained", "flann"), default="trained",
+                        help="trained: build the FLANN index over the right-hand descriptors "
+                             "once per reference and reuse it (default); flann: rebuild it "
+                             "on every knnMatch call")
+    parser.add_argument("--pipeline", type=int, metavar="N",
+                        help="run capture, N SIFT worker processes and rendering in separate "
+                             "processes, sharing frames through shared memory")
+    parser.add_argument("--serial-extract", action="store_true",
+                        help="in 2-camera mode, extract left and right features one after "
+                             "the other instead of on two threads")
+    parser.add_argument("--track", type=int, metavar="N",
+                        help="detect-then-track: run SIFT + FLANN every N frames and follow "
+                             "the matches with Lucas-Kanade optical flow in between")
+    parser.add_argument("--redetect", choices=MatchTracker.POLICIES, default="both",
+                        help="with --track, redetect on the interval, when tracking quality "
+                             "drops, or both (default)")
+    parser.add_argument("--min-tracked", type=float, default=0.5, metavar="FRACTION",
+                        help="with --track, redetect once fewer than this fraction of the "
+                             "detected matches are still tracked (default 0.5)")
+    parser.add_argument("--gallery", metavar="PATH",
+                        help="recognise which image of a gallery (built with gallery.py) "
+                             "is in view, instead of matching a second camera or self.jpg")
+    parser.add_argument("--shortlist", type=int, default=10,
+                        help="gallery images scored by the vocabulary tree (default 10)")
+    parser.add_argument("--verify", type=int, default=3,
+                        help="shortlisted images verified with RANSAC (default 3)")
+    add_profile_args(parser)
+    args = parser.parse_args(argv)
+    if args.gallery and args.pipeline:
+        parser.error("--gallery can't be combined with --pipeline")
+    if args.track and (args.pipeline or args.gallery):
+        parser.error("--track can't be combined with --pipeline or --gallery")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    profiler = profiler_from_args("sewing_machine", args)
+    left_spec = args.source or args.cam_index
 
     # --- 1. Initialize Video Sources ---
-    cap_l = cv2.VideoCapture(cam_index)
+    # Cameras are read on their own threads; the loop always gets the newest frame
+    cap_l = open_source(left_spec, width=640, height=480,
+                        realtime=args.realtime, record=args.record)
     if not cap_l.isOpened():
-        print("ERROR: Could not open webcam.")
+        print(f"ERROR: Could not open source {left_spec}.")
+        cap_l.release()
         return
 
-    cap_l.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    cap_l.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+    if args.gallery:
+        run_gallery(args, cap_l, profiler)
+        profiler.close()
+        return
 
-    cap_r = cv2.VideoCapture(1)
+    right_spec = args.right_source
+    if right_spec is None and str(left_spec).isdigit():
+        right_spec = "1"
+    cap_r = open_source(right_spec) if right_spec is not None else None
     simulation_mode = False
 
-    if not cap_r.isOpened():
+    if cap_r is None or not cap_r.isOpened():
         print("Second camera not found. Switching to 1-Camera Simulation Mode...")
+        if cap_r is not None:
+            cap_r.release()
         simulation_mode = True
         # Look for a static image to match against
         static_path = os.path.join(SCRIPT_DIR, 'self.jpg')
@@ -50,18 +567,46 @@ def main():
             cap_l.release()
             return
 
+    if args.pipeline:
+        # The capture process reopens the sources itself
+        cap_l.release()
+        if not simulation_mode:
+            cap_r.release()
+        run_pipeline(args, left_spec, None if simulation_mode else right_spec,
+                     static_img if simulation_mode else None,
+                     static_path if simulation_mode else None, profiler)
+        profiler.close()
+        return
+
     # --- 2. Configure SIFT Detector ---
     sift = cv2.SIFT_create()
 
+    # Two cameras: left and right are extracted concurrently by a persistent pair of
+    # threads, each side with its own SIFT instance
+    extract_pool = sift_r = None
+    if not simulation_mode and not args.serial_extract:
+        sift_r = cv2.SIFT_create()
+        extract_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="extract")
+
     # --- 3. Setup FLANN Matcher (KD-Tree for SIFT) ---
-    FLANN_INDEX_KDTREE = 1
-    index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
-    search_params = dict(checks=50)
-    flann = cv2.FlannBasedMatcher(index_params, search_params)
+    # A static reference only needs its index built once
+    flann = ReferenceMatcher() if args.matcher == "trained" else create_flann()
+
+    # --track N: full detection every N frames (or when tracking degrades), flow in between
+    tracker = None
+    if args.track:
+        tracker = MatchTracker(interval=args.track, policy=args.redetect,
+                               min_fraction=args.min_tracked)
+
+    # The static image is resized and detected once per frame size, not every frame
+    static_size = static_resized = static_features = None
 
     prev_time = time.time()
     fps = 0
     ratio_threshold = 0.7
+    timer = make_timer(args.timing, args.trace)
+    frames = 0
+    start_time = time.perf_counter()
 
     print("\n=== Sewing Machine: Feature Matching ===")
     print("Controls:")
@@ -70,33 +615,70 @@ def main():
     print("  q     - Quit")
     print("=========================================\n")
 
-    while True:
+    while args.max_frames is None or frames < args.max_frames:
+        timer.start_frame()
+
         # --- 4a. Capture ---
         ret_l, frame_l = cap_l.read()
         if not ret_l:
-            print("ERROR: Failed to read from webcam.")
+            if not args.headless:
+                print("ERROR: Failed to read from webcam.")
             break
 
         if simulation_mode:
             h, w = frame_l.shape[:2]
-            frame_r = cv2.resize(static_img, (w, h))
+            if static_size != (w, h):
+                static_size = (w, h)
+                static_resized = cv2.resize(static_img, static_size)
+                static_features, cache_source = cached_features(
+                    static_path, static_size, sift, image=static_img)
+                print(f"Reference features for {os.path.basename(static_path)} at {w}x{h}: "
+                      f"{len(static_features[0])} keypoints ({cache_source})")
+            frame_r = static_resized
         else:
             ret_r, frame_r = cap_r.read()
             if not ret_r:
-                print("ERROR: Failed to read from second camera.")
+                if not args.headless:
+                    print("ERROR: Failed to read from second camera.")
                 break
+        timer.mark("capture")
 
         # --- 4b. Convert to Grayscale & Detect/Compute ---
-        gray_l = cv2.cvtColor(frame_l, cv2.COLOR_BGR2GRAY)
-        gray_r = cv2.cvtColor(frame_r, cv2.COLOR_BGR2GRAY)
+        redetect = tracker is None or tracker.needs_redetect()
+        extracted = False
+        if extract_pool is not None and redetect:
+            # Both sides at once: cvtColor and detectAndCompute release the GIL
+            future_l = extract_pool.submit(extract_features, sift, frame_l)
+            future_r = extract_pool.submit(extract_features, sift_r, frame_r)
+            gray_l, kp_l, des_l = future_l.result()
+            gray_r, kp_r, des_r = future_r.result()
+            extracted = True
+        else:
+            gray_l = cv2.cvtColor(frame_l, cv2.COLOR_BGR2GRAY)
+            if not simulation_mode:
+                gray_r = cv2.cvtColor(frame_r, cv2.COLOR_BGR2GRAY)
+            timer.mark("convert")
 
-        kp_l, des_l = sift.detectAndCompute(gray_l, None)
-        kp_r, des_r = sift.detectAndCompute(gray_r, None)
+        if not redetect:
+            # --- Between detections, follow the matched points with optical flow ---
+            tracker.track(gray_l, None if simulation_mode else gray_r)
+            kp_l, kp_r, good_matches = tracker.keypoints_and_matches()
+            timer.mark("track")
+        else:
+            if not extracted:
+                kp_l, des_l = sift.detectAndCompute(gray_l, None)
+                if simulation_mode:
+                    kp_r, des_r = static_features
+                else:
+                    kp_r, des_r = sift.detectAndCompute(gray_r, None)
+            timer.mark("detect")
 
-        # --- 4c. Match & Filter ---
-        good_matches = []
-        if des_l is not None and des_r is not None and len(des_l) >= 2 and len(des_r) >= 2:
-            matches = flann.knnMatch(des_l, des_r, k=2)
+            # --- 4c. Match & Filter ---
+            good_matches = []
+            if isinstance(flann, ReferenceMatcher):
+                flann.set_reference(des_r)
+                timer.mark("index")
+            matches = knn_pairs(flann, des_l, des_r)
 
             # Lowe's Ratio Test
             for pair in matches:
@@ -104,6 +686,11 @@ def main():
                     m, n = pair
                     if m.distance < ratio_threshold * n.distance:
                         good_matches.append(m)
+            timer.mark("match")
+            if tracker is not None:
+                tracker.reset(gray_l, None if simulation_mode else gray_r,
+                              [kp_l[m.queryIdx].pt for m in good_matches],
+                              [kp_r[m.trainIdx].pt for m in good_matches])
 
         # --- 5. Visualization ---
         match_img = cv2.drawMatches(
@@ -121,39 +708,71 @@ def main():
 
         # Overlay text
         mode_label = "1-CAM SIMULATION" if simulation_mode else "2-CAM LIVE"
+        if extract_pool is not None:
+            mode_label += " | 2 THREADS"
+        if tracker is not None:
+            mode_label += " | TRACK"
+            match_text = f"Matches: tracked {len(good_matches)} | redetected {tracker.detected}"
+        else:
+            match_text = f"Matches: {len(good_matches)}"
         cv2.putText(match_img, f"Mode: {mode_label}", (10, 25),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-        cv2.putText(match_img, f"Matches: {len(good_matches)} | Ratio: {ratio_threshold:.2f}",
+        cv2.putText(match_img, f"{match_text} | Ratio: {ratio_threshold:.2f}",
                     (10, 55), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
         cv2.putText(match_img, f"FPS: {fps:.1f}", (10, 85),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
         cv2.putText(match_img, f"Keypoints: L={len(kp_l)} R={len(kp_r)}",
                     (10, 115), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        cv2.putText(match_img, cap_l.stats_text(), (10, 145),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        hud_y = 175
+        if isinstance(flann, ReferenceMatcher):
+            cv2.putText(match_img, flann.stats_text(), (10, hud_y),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+            hud_y += 30
+        if tracker is not None:
+            cv2.putText(match_img, tracker.stats_text(), (10, hud_y),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+            hud_y += 30
+        timer.draw(match_img, 10, hud_y)
+        timer.mark("draw")
+
+        frames += 1
+        profiler.frame()
+        if args.headless:
+            timer.end_frame()
+            continue
 
         cv2.imshow("Sewing Machine - Press 'q' to quit", match_img)
 
         # --- Handle Input ---
         key = cv2.waitKey(1) & 0xFF
+        timer.mark("display")
+        timer.end_frame()
 
-        if key == ord('q'):
+        ratio_threshold = handle_key(key, match_img, ratio_threshold)
+        if ratio_threshold is None:
             break
-        elif key == ord('s'):
-            timestamp = time.strftime("%Y%m%d_%H%M%S")
-            out_path = os.path.join(SCRIPT_DIR, 'outputs', f'screenshot_{timestamp}.png')
-            cv2.imwrite(out_path, match_img)
-            print(f"Screenshot saved: {out_path}")
-        elif key == ord('+') or key == ord('='):
-            ratio_threshold = min(0.95, ratio_threshold + 0.05)
-            print(f"Ratio threshold: {ratio_threshold:.2f}")
-        elif key == ord('-') or key == ord('_'):
-            ratio_threshold = max(0.1, ratio_threshold - 0.05)
-            print(f"Ratio threshold: {ratio_threshold:.2f}")
 
     # Cleanup
+    if extract_pool is not None:
+        extract_pool.shutdown()
     cap_l.release()
     if not simulation_mode:
         cap_r.release()
-    cv2.destroyAllWindows()
+    timer.close()
+    if isinstance(flann, ReferenceMatcher):
+        flann.report()
+    if tracker is not None:
+        counts = tracker.redetections
+        print(f"Redetections: {sum(counts.values())} ({counts['interval']} interval, "
+              f"{counts['quality']} quality) in {frames} frames")
+    profiler.close()
+    elapsed = time.perf_counter() - start_time
+    if frames and elapsed > 0:
+        print(f"{frames} frames in {elapsed:.2f}s: {frames / elapsed:.1f} FPS")
+    if not args.headless:
+        cv2.destroyAllWindows()
 
 
 if __name__ == "__main__":
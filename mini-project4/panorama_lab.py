@@ -6,6 +6,8 @@ Builds a panoramic image from manually captured frames using a live camera feed.
 Pipeline: ORB Detection → BF Matching → RANSAC Homography → Perspective Warp → Composition
 """
 
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 import time
@@ -13,24 +15,44 @@ import os
 import sys
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(SCRIPT_DIR))
+
+from common.frame_source import open_source
+from common.profiling import add_profile_args, profiler_from_args
+from common.shm_pipeline import SharedFramePipeline
+from common.stage_timer import NULL_TIMER, make_timer
+
 OUTPUT_DIR = os.path.join(SCRIPT_DIR, 'outputs')
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 MIN_MATCH_COUNT = 15
+ORB_FEATURES = 3000
+
+
+def orb_features(img, orb=None):
+    """ORB keypoint positions (N x 2 float32) and descriptors of an image."""
+    orb = orb or cv2.ORB_create(nfeatures=ORB_FEATURES)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    kp, des = orb.detectAndCompute(gray, None)
+    return np.float32([k.pt for k in kp]).reshape(-1, 2), des
 
 
-def detect_and_match(img1, img2):
+def detect_and_match(img1, img2, timer=NULL_TIMER, features1=None, features2=None):
     """Detect ORB features and match between two images.
 
+    features1/features2 are (pts, descriptors) already found for an
+    image (e.g. by the pipeline workers); missing ones are detected here.
     Returns matched keypoints (src_pts, dst_pts) or (None, None) on failure.
     src_pts are from img2, dst_pts are from img1 — so the homography maps img2 → img1.
     """
-    orb = cv2.ORB_create(nfeatures=3000)
-
-    gray1 = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
-    gray2 = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
-
-    kp1, des1 = orb.detectAndCompute(gray1, None)
-    kp2, des2 = orb.detectAndCompute(gray2, None)
+    if features1 is None or features2 is None:
+        orb = cv2.ORB_create(nfeatures=ORB_FEATURES)
+        if features1 is None:
+            features1 = orb_features(img1, orb)
+        if features2 is None:
+            features2 = orb_features(img2, orb)
+        timer.mark("detect")
+    pts1, des1 = features1
+    pts2, des2 = features2
 
     if des1 is None or des2 is None:
         print("  [WARN] No descriptors found in one of the images.")
@@ -47,14 +69,15 @@ def detect_and_match(img1, img2):
             m, n = pair
             if m.distance < 0.75 * n.distance:
                 good.append(m)
+    timer.mark("match")
 
     print(f"  Matches found: {len(good)} (need {MIN_MATCH_COUNT})")
 
     if len(good) < MIN_MATCH_COUNT:
         return None, None
 
-    src_pts = np.float32([kp2[m.queryIdx].pt for m in good]).reshape(-1, 1, 2)
-    dst_pts = np.float32([kp1[m.trainIdx].pt for m in good]).reshape(-1, 1, 2)
+    src_pts = np.float32([pts2[m.queryIdx] for m in good]).reshape(-1, 1, 2)
+    dst_pts = np.float32([pts1[m.trainIdx] for m in good]).reshape(-1, 1, 2)
 
     return src_pts, dst_pts
 
@@ -74,16 +97,17 @@ def compute_homography(src_pts, dst_pts):
     return H
 
 
-def stitch_pair(base, new_img):
+def stitch_pair(base, new_img, timer=NULL_TIMER, base_features=None, new_features=None):
     """Stitch new_img onto base using feature matching + homography + warping.
 
     Returns the stitched panorama or None on failure.
     """
-    src_pts, dst_pts = detect_and_match(base, new_img)
+    src_pts, dst_pts = detect_and_match(base, new_img, timer, base_features, new_features)
     if src_pts is None:
         return None
 
     H = compute_homography(src_pts, dst_pts)
+    timer.mark("homography")
     if H is None:
         return None
 
@@ -118,6 +142,7 @@ def stitch_pair(base, new_img):
 
     # Warp new_img into canvas space (translation @ H)
     warped = cv2.warpPerspective(new_img, translation @ H, (canvas_w, canvas_h))
+    timer.mark("warp")
 
     # Paste base image onto canvas at the translated position
     x_off = -x_min
@@ -128,7 +153,9 @@ def stitch_pair(base, new_img):
     base_mask = (base > 0).any(axis=2)
     roi[base_mask] = base[base_mask]
 
-    return crop_black_borders(warped)
+    panorama = crop_black_borders(warped)
+    timer.mark("compose")
+    return panorama
 
 
 def crop_black_borders(img):
@@ -147,20 +174,166 @@ def crop_black_borders(img):
     return img[y:y + h, x:x + w]
 
 
-def main():
-    cam_index = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+def stitch_all(captured_frames, timer=NULL_TIMER, features=None):
+    """Stitch the captured frames in order onto the first one.
 
-    cap = cv2.VideoCapture(cam_index)
-    if not cap.isOpened():
-        print("ERROR: Could not open webcam.")
-        return
-
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+    features optionally gives each frame's (pts, descriptors), already
+    detected; only the growing panorama is then detected here.
+    Returns the panorama, or None if some frame could not be stitched.
+    """
+    print(f"\nStitching {len(captured_frames)} frames...")
+    features = features or [None] * len(captured_frames)
+    panorama = captured_frames[0]
+    base_features = features[0]
+    for i in range(1, len(captured_frames)):
+        print(f"  Stitching frame {i + 1} onto panorama...")
+        result = stitch_pair(panorama, captured_frames[i], timer, base_features, features[i])
+        base_features = None
+        if result is None:
+            print(f"  [FAIL] Could not stitch frame {i + 1}. "
+                  "Ensure 60-70% overlap and textured scenes.")
+            return None
+        panorama = result
+    return panorama
+
+
+def save_panorama(panorama):
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
+    out_path = os.path.join(OUTPUT_DIR, f'panorama_{timestamp}.png')
+    cv2.imwrite(out_path, panorama)
+    print(f"Panorama saved: {out_path}")
+
+
+# --- Pipeline mode: stitching detection in worker processes ---
+
+def feature_setup():
+    """Per-worker ORB detector and Hamming matcher."""
+    return {
+        "orb": cv2.ORB_create(nfeatures=ORB_FEATURES),
+        "bf": cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False),
+    }
+
+
+def frame_features(state, frames, context=None):
+    """ORB features of a live frame, detected in a worker on a shared-memory slot.
+
+    Any frame may be the one captured, so each comes back with the
+    (pts, descriptors) stitching would otherwise detect on the preview
+    loop. Since they are at hand, the worker also counts ratio-test
+    matches against the last captured frame's descriptors (context,
+    None until the first capture) for the overlap indicator.
+    """
+    pts, des = orb_features(frames[0], state["orb"])
+    matches = None
+    if context is not None:
+        matches = 0
+        if des is not None and len(des) >= 2 and len(context) >= 2:
+            for pair in state["bf"].knnMatch(des, context, k=2):
+                if len(pair) == 2 and pair[0].distance < 0.75 * pair[1].distance:
+                    matches += 1
+    return {"features": (pts, des), "matches": matches}
+
+
+def camera_frames(cap):
+    """(frame, None) from cap until it ends, matching the pipeline's (frame, result)."""
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            return
+        yield frame, None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Real-time panorama stitching.")
+    parser.add_argument("cam_index", nargs="?", default="0", help="camera index (default 0)")
+    parser.add_argument("--source",
+                        help="frames instead of a camera: video file, image directory, "
+                             "recorded session or synthetic[:WxH[:N]]")
+    parser.add_argument("--record", metavar="DIR",
+                        help="save every frame to DIR for exact replay with --source DIR")
+    parser.add_argument("--realtime", action="store_true",
+                        help="replay a recorded session at its recorded pace")
+    parser.add_argument("--headless", action="store_true",
+                        help="no window: capture every --capture-every frames, "
+                             "stitch when the source ends")
+    parser.add_argument("--capture-every", type=int, default=30,
+                        help="headless: frames between automatic captures (default 30)")
+    parser.add_argument("--max-frames", type=int, help="stop after this many frames")
+    parser.add_argument("--timing", action="store_true",
+                        help="show p50/p95/p99 per stage and print them at exit")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="write per-frame stage times to PATH (.csv or .json)")
+    parser.add_argument("--pipeline", type=int, metavar="N",
+                        help="run capture, N ORB worker processes and the preview in separate "
+                             "processes sharing frames through shared memory; stitching runs "
+                             "in the background on the workers' features (ignored headless)")
+    add_profile_args(parser)
+    args = parser.parse_args(argv)
+    if args.capture_every < 1:
+        parser.error("--capture-every must be at least 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    profiler = profiler_from_args("panorama_lab", args)
+    source = args.source or args.cam_index
+
+    cap = pipeline = None
+    if args.pipeline and args.headless:
+        # Nothing to keep responsive headless, and only every --capture-every frame is used
+        print("--pipeline has no effect with --headless; running in-process.")
+        args.pipeline = None
+    if args.pipeline:
+        # Workers detect ORB features of every live frame, so a captured frame's features
+        # are ready for stitching, and count overlap against the last capture for the HUD
+        pipeline = SharedFramePipeline([source], frame_features, feature_setup,
+                                       workers=args.pipeline, realtime=args.realtime,
+                                       record=args.record, context_bytes=ORB_FEATURES * 32)
+        try:
+            pipeline.start()
+        except IOError as e:
+            print(f"ERROR: {e}")
+            return
+        live = ((frames[0], result) for _, frames, result in pipeline)
+        status_text = lambda: f"Pipeline x{pipeline.workers} | dropped {pipeline.dropped}"
+    else:
+        # A camera is read on a background thread so stitching never backs up its queue
+        cap = open_source(source, width=640, height=480,
+                          realtime=args.realtime, record=args.record)
+        if not cap.isOpened():
+            print(f"ERROR: Could not open source {source}.")
+            cap.release()
+            return
+        live = camera_frames(cap)
+        status_text = cap.stats_text
+
+    def capture(frame, result):
+        captured_frames.append(frame.copy())
+        captured_features.append(result["features"] if result is not None else None)
+        set_reference()
+        print(f"Frame {len(captured_frames)} captured.")
+
+    def set_reference():
+        if pipeline is not None:
+            des = captured_features[-1][1] if captured_features else None
+            pipeline.set_context(des)
+
+    def show_panorama(panorama):
+        if panorama is not None:
+            # Display result
+            cv2.imshow("Panorama Result", panorama)
+            save_panorama(panorama)
 
     captured_frames = []
+    captured_features = []
+    # With --pipeline, stitching runs on this thread so the preview keeps going
+    stitcher = ThreadPoolExecutor(max_workers=1) if pipeline is not None else None
+    stitch_job = None
     prev_time = time.time()
     fps = 0
+    frames = 0
+    timer = make_timer(args.timing, args.trace)
 
     print("\n=== Real-Time Panorama Stitching ===")
     print("Controls:")
@@ -170,11 +343,20 @@ def main():
     print("  q  - Quit")
     print("====================================\n")
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("ERROR: Failed to read from webcam.")
+    timer.start_frame()
+    for frame, result in live:
+        if args.max_frames is not None and frames >= args.max_frames:
             break
+        frames += 1
+        profiler.frame()
+        timer.mark("capture")
+
+        if args.headless:
+            if (frames - 1) % args.capture_every == 0:
+                capture(frame, result)
+            timer.end_frame()
+            timer.start_frame()
+            continue
 
         # FPS
         current_time = time.time()
@@ -188,54 +370,77 @@ def main():
                     (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
         cv2.putText(display, f"FPS: {fps:.1f}",
                     (10, 55), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        cv2.putText(display, status_text(),
+                    (10, 85), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        if stitch_job is not None:
+            if stitch_job.done():
+                show_panorama(stitch_job.result())
+                stitch_job = None
+            else:
+                cv2.putText(display, "Stitching...", (10, display.shape[0] - 75),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+        if result is not None and result["matches"] is not None:
+            enough = result["matches"] >= MIN_MATCH_COUNT
+            cv2.putText(display, f"Overlap: {result['matches']} matches",
+                        (10, display.shape[0] - 45), cv2.FONT_HERSHEY_SIMPLEX, 0.6,
+                        (0, 255, 0) if enough else (0, 0, 255), 2)
         cv2.putText(display, "s:capture  a:stitch  r:reset  q:quit",
                     (10, display.shape[0] - 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        timer.draw(display, 10, 115)
+        timer.mark("draw")
 
         cv2.imshow("Panorama Lab - Live Preview", display)
 
         key = cv2.waitKey(1) & 0xFF
+        timer.mark("display")
 
         if key == ord('q'):
             break
 
         elif key == ord('s'):
-            captured_frames.append(frame.copy())
-            print(f"Frame {len(captured_frames)} captured.")
+            capture(frame, result)
 
         elif key == ord('a'):
             if len(captured_frames) < 2:
                 print("Need at least 2 frames to stitch. Keep capturing!")
-                continue
-
-            print(f"\nStitching {len(captured_frames)} frames...")
-            panorama = captured_frames[0]
-
-            success = True
-            for i in range(1, len(captured_frames)):
-                print(f"  Stitching frame {i + 1} onto panorama...")
-                result = stitch_pair(panorama, captured_frames[i])
-                if result is None:
-                    print(f"  [FAIL] Could not stitch frame {i + 1}. "
-                          "Ensure 60-70% overlap and textured scenes.")
-                    success = False
-                    break
-                panorama = result
-
-            if success:
-                # Display result
-                cv2.imshow("Panorama Result", panorama)
-                # Save
-                timestamp = time.strftime("%Y%m%d_%H%M%S")
-                out_path = os.path.join(OUTPUT_DIR, f'panorama_{timestamp}.png')
-                cv2.imwrite(out_path, panorama)
-                print(f"Panorama saved: {out_path}")
+            elif stitch_job is not None:
+                print("Still stitching the previous panorama.")
+            elif stitcher is not None:
+                # The timer isn't thread-safe, so background stitches aren't broken into stages
+                stitch_job = stitcher.submit(stitch_all, list(captured_frames), NULL_TIMER,
+                                             list(captured_features))
+            else:
+                show_panorama(stitch_all(captured_frames, timer))
 
         elif key == ord('r'):
             captured_frames.clear()
+            captured_features.clear()
+            set_reference()
             print("Cleared all captured frames.")
 
-    cap.release()
-    cv2.destroyAllWindows()
+        timer.end_frame()
+        timer.start_frame()
+
+    if pipeline is not None:
+        pipeline.stop()
+        if stitch_job is not None:
+            show_panorama(stitch_job.result())
+        stitcher.shutdown()
+    else:
+        cap.release()
+    if args.headless:
+        if len(captured_frames) >= 2:
+            timer.start_frame()
+            panorama = stitch_all(captured_frames, timer)
+            timer.end_frame()
+            if panorama is not None:
+                save_panorama(panorama)
+        else:
+            print("Need at least 2 frames to stitch; lower --capture-every.")
+    else:
+        cv2.destroyAllWindows()
+    timer.close()
+    profiler.close()
 
 
 if __name__ == "__main__":
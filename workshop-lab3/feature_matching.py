@@ -18,6 +18,11 @@ import cv2
 import sys
 import os
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.profiling import profile_script
+
+profile_script('feature_matching')
+
 # Create outputs directory if it doesn't exist
 os.makedirs('outputs', exist_ok=True)
 
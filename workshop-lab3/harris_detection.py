@@ -14,6 +14,12 @@ Harris Corner Detection works by:
 import cv2
 import numpy as np
 import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.profiling import profile_script
+
+profile_script('harris_detection')
 
 # Create outputs directory if it doesn't exist
 os.makedirs('outputs', exist_ok=True)
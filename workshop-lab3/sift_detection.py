@@ -12,6 +12,12 @@ SIFT (Scale-Invariant Feature Transform) provides:
 
 import cv2
 import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.profiling import profile_script
+
+profile_script('sift_detection')
 
 # Create outputs directory if it doesn't exist
 os.makedirs('outputs', exist_ok=True)
@@ -6,6 +6,12 @@ Computes and plots per-channel (BGR) histograms of a color image.
 import cv2
 import matplotlib.pyplot as plt
 import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.profiling import profile_script
+
+profile_script('color_histogram')
 
 # Load color image (BGR by default)
 img = cv2.imread(os.path.join(os.path.dirname(__file__), 'sample.jpg'))
@@ -6,6 +6,12 @@ Computes and plots the intensity histogram of a grayscale image.
 import cv2
 import matplotlib.pyplot as plt
 import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.profiling import profile_script
+
+profile_script('grayscale_histogram')
 
 # Load image in grayscale (flag 0)
 img = cv2.imread(os.path.join(os.path.dirname(__file__), 'sample.jpg'), 0)